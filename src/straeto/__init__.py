@@ -34,6 +34,7 @@ from .straeto import (
     BusStop,
     BusHalt,
     distance,
+    make_distance_from,
     locfmt,
     refresh,
     initialize,
@@ -60,6 +61,7 @@ __all__ = [
     "BusStop",
     "BusHalt",
     "distance",
+    "make_distance_from",
     "locfmt",
     "refresh",
     "initialize",
@@ -0,0 +1,190 @@
+"""
+
+    Straeto: A package encapsulating information about Iceland's buses and bus routes
+
+    Copyright (C) 2023 Miðeind ehf.
+    Original author: Vilhjálmur Þorsteinsson
+
+        This program is free software: you can redistribute it and/or modify
+        it under the terms of the GNU General Public License as published by
+        the Free Software Foundation, either version 3 of the License, or
+        (at your option) any later version.
+
+        This program is distributed in the hope that it will be useful,
+        but WITHOUT ANY WARRANTY; without even the implied warranty of
+        MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+        GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+    This module contains the command line interface of the Straeto
+    package, containing a mix of maintenance commands and demo cases.
+    Normally you use Straeto as a module through import, not as a main program.
+
+    Usage: python -m straeto [<command>] [options]
+
+    Without a command, the 'test' command is run, printing a few demo cases.
+
+"""
+
+from typing import List, Optional, Sequence
+
+import sys
+import argparse
+from datetime import datetime
+from operator import itemgetter
+
+from .straeto import (
+    Bus,
+    BusRoute,
+    BusSchedule,
+    entf,
+    locfmt,
+    print_closest_stop,
+    print_next_arrivals,
+    refresh,
+    utcnow,
+    _MIDEIND_LOCATION,
+)
+
+
+def dump_schedule(now: datetime) -> None:
+    """Dump the schedule data for all routes"""
+    for route in BusRoute.sorted_routes():
+        print(f"{route}:")
+        for service in route.active_services_today(now):
+            print(f"   service {service.service_id}")
+            for trip in service.trips:
+                lines = [f"      trip {trip.trip_id}"]
+                lines.extend(
+                    f"         halt {h:02}:{m:02}:{sec:02} at {stop_name}"
+                    for h, m, sec, stop_name in trip.iter_halts_fast()
+                )
+                lines.append("")
+                sys.stdout.write("\n".join(lines))
+
+
+def dump_buses(now: datetime, route_ids: Optional[Sequence[str]] = None) -> None:
+    """Dump the real-time locations of the buses on the given routes,
+    or of all buses if no routes are given"""
+    if route_ids:
+        all_buses = [(route_id, Bus.buses_on_route(route_id)) for route_id in route_ids]
+    else:
+        all_buses = list(Bus.all_buses().items())
+    for route_id, val in sorted(all_buses, key=lambda b: (len(b[0]), b[0])):
+        route = BusRoute.lookup(route_id)
+        print(f"{route}:")
+        if route is None:
+            continue
+        lines = [
+            f"   service {service.service_id}"
+            for service in route.active_services_today(now)
+        ]
+        # Compute the distance of each bus once, for both sorting and printing
+        decorated = [(entf(bus.location), bus) for bus in val]
+        decorated.sort(key=itemgetter(0))
+        lines.extend(
+            f"   {bus.timestamp} loc:{locfmt(bus.location)}, "
+            f"head:{bus.heading:>6.2f}, stop:{bus.stop}, "
+            f"next:{bus.next_stop}, code:{bus.code}, dist:{dist:.2f}"
+            for dist, bus in decorated
+        )
+        lines.append("")
+        sys.stdout.write("\n".join(lines))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Parse the command line and run the requested command"""
+
+    parser = argparse.ArgumentParser(
+        prog="python -m straeto",
+        description="A Python wrapper for the bus schedules of Straeto bs",
+    )
+
+    parser.add_argument("--quiet", action="store_true", help="suppress output")
+
+    subparsers = parser.add_subparsers(dest="command", help="subcommand")
+
+    parser_refresh = subparsers.add_parser(
+        "refresh", help="refresh schedule data from Straeto bs website"
+    )
+    parser_refresh.add_argument(
+        "--if_older_than",
+        nargs="?",
+        type=int,
+        default=0,
+        help="refresh only if existing GTFS.ZIP file is older than N hours",
+    )
+
+    subparsers.add_parser("test", help="run test code (the default)")
+
+    subparsers.add_parser("closest", help="print the bus stop closest to Miðeind")
+
+    parser_arrivals = subparsers.add_parser(
+        "arrivals", help="print the next arrivals of a route at a stop"
+    )
+    parser_arrivals.add_argument("route", help="route number, e.g. 14")
+    parser_arrivals.add_argument(
+        "stop",
+        nargs="?",
+        default=None,
+        help="stop name (default: the stop closest to Miðeind)",
+    )
+
+    parser_schedule = subparsers.add_parser(
+        "schedule", help="print today's schedule for a route"
+    )
+    parser_schedule.add_argument("route", help="route id, e.g. ST.3")
+
+    subparsers.add_parser("dump-schedule", help="dump today's schedule for all routes")
+
+    parser_buses = subparsers.add_parser(
+        "dump-buses", help="dump the real-time locations of buses"
+    )
+    parser_buses.add_argument(
+        "routes", nargs="*", help="route ids, e.g. ST.14 (default: all routes)"
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "refresh":
+        if refresh(if_older_than=args.if_older_than):
+            if not args.quiet:
+                print("Refresh completed")
+        else:
+            if not args.quiet:
+                print("Refresh was not necessary or not successful")
+        return 0
+
+    # Use a single timepoint for all of the output below, so that
+    # the active services of each route are computed once and then cached
+    now = utcnow()
+
+    if args.command == "closest":
+        # 'Hvar er næsta stoppistöð?'
+        print_closest_stop(_MIDEIND_LOCATION)
+    elif args.command == "arrivals":
+        # 'Hvenær kemur strætó númer 14?'
+        print_next_arrivals(
+            BusSchedule.for_day(now=now), args.stop or _MIDEIND_LOCATION, args.route
+        )
+    elif args.command == "schedule":
+        BusSchedule.for_day(now=now).print_schedule(args.route)
+    elif args.command == "dump-schedule":
+        dump_schedule(now)
+    elif args.command == "dump-buses":
+        dump_buses(now, args.routes)
+    else:
+        # This must be the 'test' command, which is also the default
+        sched_today = BusSchedule.for_day(now=now)
+        sched_today.print_schedule("ST.3")
+        dump_buses(now, ["ST.14"])
+        print_next_arrivals(sched_today, _MIDEIND_LOCATION, "14")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -42,36 +42,56 @@
 from __future__ import annotations
 
 from typing import (
+    IO,
+    Callable,
     DefaultDict,
     Dict,
     FrozenSet,
     Iterable,
+    Iterator,
     Mapping,
     Match,
+    Pattern,
     Set,
+    TextIO,
     Tuple,
     Optional,
     List,
     Union,
+    cast,
 )
 
+import io
 import os
 import re
+import csv
+import pickle
 import math
-from datetime import date, time, datetime, timedelta, timezone
+import heapq
+from bisect import bisect_left, bisect_right
+from array import array
+from datetime import date, datetime, timedelta, timezone
 import threading
+import sys
+from time import monotonic
 import functools
+from itertools import islice
 from collections import defaultdict
 import xml.etree.ElementTree as ET
 import logging
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
 import shutil
 import zipfile
+import zlib
 
 
 HmsTuple = Tuple[int, int, int]
 LatLonTuple = Tuple[float, float]
+# (Python version, pickle protocol, ((path, mtime_ns, size), ...))
+_CacheKey = Tuple[Tuple[int, ...], int, Tuple[Tuple[str, int, int], ...]]
 
 # Set _DEBUG to True to emit diagnostic messages
 _DEBUG = False
@@ -102,6 +122,34 @@ _STATUS_URL = _status_url
 # Real-time status refresh interval
 _REFRESH_INTERVAL = 60
 
+# Timeout, in seconds, for real-time status requests
+_STATUS_TIMEOUT = 5
+
+# HTTP session for real-time status requests, keeping the connection
+# to the status server alive between refreshes
+_session = requests.Session()
+_status_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+_session.mount("https://", _status_adapter)
+_session.mount("http://", _status_adapter)
+
+# Returned by Bus._fetch_state() when the server reports that the
+# real-time status has not changed since it was last fetched
+_NOT_MODIFIED: List[ET.Element] = []
+
+# Read buffer size for the GTFS text files
+_GTFS_BUFFER_SIZE = 1 << 20
+
+# The GTFS text files that the schedule data is read from
+_GTFS_FILES = ("stops.txt", "calendar_dates.txt", "trips.txt", "stop_times.txt")
+
+# Pickled copy of the fully initialized schedule data, which is reused
+# as long as the GTFS files (and this module) are unchanged. Each Python
+# version has its own file, so that interpreters sharing a checkout
+# don't keep overwriting each other's cache.
+_CACHE_PATH = _RESOURCES_PATH("gtfs-py{0}{1}.pkl".format(*sys.version_info[:2]))
+# Pickle protocol 4 is the highest one that Python 3.7 can read
+_CACHE_PROTOCOL = 4
+
 # Fallback location to fetch status info from, if not available via HTTP
 _STATUS_FILE = _RESOURCES_PATH("status.xml")
 
@@ -134,17 +182,74 @@ _VOICE_NAMES: Mapping[str, str] = {
     "Íþróttamiðstöð ÍR": "Íþróttamiðstöð Í R",
 }
 
+# Size, in degrees, of the (lat, lon) cells of the bus stop spatial index
+_GRID_CELL_SIZE = 0.02
+# Maximum number of grid cells to look up before falling back to
+# scanning all bus stops
+_GRID_MAX_CELLS = 1024
+# Initial radius, in km, when searching for the closest bus stops
+_GRID_SEARCH_RADIUS = 1.0
+# Number of decimals that locations are rounded to when caching closest-stop
+# queries (5 decimals are about 1 meter)
+_LOCATION_CACHE_DECIMALS = 5
+
+# Regex for splitting stop names into words, for the word index
+_WORD_RE = re.compile(r"\w+")
+
+# Regex for normalizing stop names for searching: hyphens and slashes,
+# along with any surrounding whitespace, and runs of whitespace,
+# are all replaced by a single space
+_NORM_RE = re.compile(r"\s*[-/]\s*|\s{2,}")
+
+
+def _search_key(name: str) -> str:
+    """Return the normalized, lowercase search key for a stop name"""
+    return _NORM_RE.sub(" ", name.lower())
+
+
+@functools.lru_cache(maxsize=512)
+def _whole_word_pattern(s: str) -> Pattern[str]:
+    """Return a compiled regex that matches the given string as a whole word,
+    i.e. not preceded or followed by a word character. Unlike \\b, this also
+    works for strings that begin or end with punctuation, such as '(bsí)'"""
+    return re.compile(r"(?<!\w)" + re.escape(s) + r"(?!\w)")
+
+
+# Search keys for the voice names
+_VOICE_KEYS: Mapping[str, str] = {
+    name: _search_key(voice) for name, voice in _VOICE_NAMES.items()
+}
+
 # In case of conflict between route numbers, resolve the conflict by
 # looking up areas in the following order (which in practice means that '1'
 # resolves to bus route number 1 in the capital area, not in the east fjords)
 _DEFAULT_AREA_PRIORITY = ("ST", "SU", "VL", "SN", "NO", "RY", "AF")
 
+_EMPTY_SET: FrozenSet[str] = frozenset()
+
 
 def utcnow() -> datetime:
     """Return the current time in UTC"""
     return datetime.now(timezone.utc)
 
 
+def _open_gtfs(name: str) -> TextIO:
+    """Open a GTFS text file for reading from the resources/ subdirectory,
+    or, if it has not been extracted there, directly from the GTFS.zip file"""
+    path = _RESOURCES_PATH(name)
+    if not os.path.exists(path) and os.path.exists(_GTFS_PATH):
+        with zipfile.ZipFile(_GTFS_PATH, "r") as z:
+            member = z.open(name)
+        # The zip member decompresses in small chunks: put a large
+        # buffer in front of it before decoding the text
+        return io.TextIOWrapper(
+            io.BufferedReader(member, buffer_size=_GTFS_BUFFER_SIZE),  # type: ignore
+            encoding="utf-8",
+            newline="",
+        )
+    return open(path, "r", encoding="utf-8", newline="", buffering=_GTFS_BUFFER_SIZE)
+
+
 def distance(loc1: LatLonTuple, loc2: LatLonTuple) -> float:
     """
     Calculate the Haversine distance.
@@ -172,23 +277,56 @@ def distance(loc1: LatLonTuple, loc2: LatLonTuple) -> float:
         /getting-distance-between-two-points-based-on-latitude-longitude
 
     """
-    lat1, lon1 = loc1
-    lat2, lon2 = loc2
-
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    slat = math.sin(dlat / 2)
-    slon = math.sin(dlon / 2)
-    a = (
-        slat * slat
-        + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * slon * slon
-    )
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return _EARTH_RADIUS * c
+    return _haversine(loc1[0], loc1[1], loc2[0], loc2[1])
+
+
+def _haversine(
+    lat1: float,
+    lon1: float,
+    lat2: float,
+    lon2: float,
+    *,
+    _radians=math.radians,
+    _sin=math.sin,
+    _cos=math.cos,
+    _sqrt=math.sqrt,
+    _asin=math.asin,
+) -> float:
+    """Calculate the Haversine distance in km between two points given
+    as separate float coordinates, in degrees. The math functions are
+    bound as default arguments so that they are looked up as locals."""
+    dlat = _radians(lat2 - lat1)
+    dlon = _radians(lon2 - lon1)
+    slat = _sin(dlat * 0.5)
+    slon = _sin(dlon * 0.5)
+    a = slat * slat + _cos(_radians(lat1)) * _cos(_radians(lat2)) * slon * slon
+    # Guard against a rounding error pushing a above 1 for antipodal points
+    return 2 * _EARTH_RADIUS * _asin(_sqrt(min(a, 1.0)))
+
+
+def make_distance_from(loc1: LatLonTuple) -> Callable[[LatLonTuple], float]:
+    """Return a function that calculates the Haversine distance in km
+    from the fixed location loc1 to a given location. The conversion
+    of loc1 to radians, and the cosine of its latitude, are computed
+    only once."""
+    lat1 = math.radians(loc1[0])
+    lon1 = math.radians(loc1[1])
+    cos_lat1 = math.cos(lat1)
+    radians, sin, cos = math.radians, math.sin, math.cos
+    sqrt, asin = math.sqrt, math.asin
+
+    def distance_from(loc2: LatLonTuple) -> float:
+        lat2 = radians(loc2[0])
+        slat = sin((lat2 - lat1) * 0.5)
+        slon = sin((radians(loc2[1]) - lon1) * 0.5)
+        a = slat * slat + cos_lat1 * cos(lat2) * slon * slon
+        return 2 * _EARTH_RADIUS * asin(sqrt(min(a, 1.0)))
+
+    return distance_from
 
 
 # Entfernung - used for test purposes
-entf = functools.partial(distance, _MIDEIND_LOCATION)
+entf = make_distance_from(_MIDEIND_LOCATION)
 
 
 def locfmt(loc: LatLonTuple) -> str:
@@ -196,6 +334,16 @@ def locfmt(loc: LatLonTuple) -> str:
     return "({0:.6f},{1:.6f})".format(loc[0], loc[1])
 
 
+def _pack_hms(hms: HmsTuple) -> int:
+    """Pack a (h, m, s) tuple into an integer number of seconds since midnight"""
+    return hms[0] * 3600 + hms[1] * 60 + hms[2]
+
+
+def _unpack_hms(t: int) -> HmsTuple:
+    """Unpack an integer number of seconds since midnight into a (h, m, s) tuple"""
+    return (t // 3600, (t // 60) % 60, t % 60)
+
+
 def round_to_hh_mm(ts: datetime, round_down: bool = False) -> HmsTuple:
     """Round a timestamp to a (h, m, s) tuple of the form hh:mm:00"""
     h, m, s = ts.hour, ts.minute, ts.second
@@ -220,56 +368,60 @@ class BusCalendar:
     are active on each date."""
 
     # Call BusCalendar.initialize() to initialize the calendar
-    _calendar: DefaultDict[date, Set[str]] = defaultdict(set)
+    # Dict of date, as an int of the form yyyymmdd -> set of active service_ids
+    _calendar: Dict[int, FrozenSet[str]] = dict()
+    # Single-slot cache of today's date and active service_ids
+    _today: Optional[Tuple[date, FrozenSet[str]]] = None
 
     @staticmethod
-    def lookup(d: date) -> Set[str]:
+    def lookup(d: date) -> FrozenSet[str]:
         """Return a set of service_ids that are active on the given date"""
-        return BusCalendar._calendar.get(d, set())
+        return BusCalendar._calendar.get(
+            d.year * 10000 + d.month * 100 + d.day, _EMPTY_SET
+        )
 
     @staticmethod
-    def today() -> Set[str]:
-        """Return a set of service_ids that are active today (UTC/Icelandic time)"""
-        now = utcnow()
-        return BusCalendar.lookup(date(now.year, now.month, now.day))
+    def today(now: Optional[datetime] = None) -> FrozenSet[str]:
+        """Return a set of service_ids that are active today (UTC/Icelandic
+        time). Callers can pass in the current time, if they already have it."""
+        if now is None:
+            now = utcnow()
+        today = date(now.year, now.month, now.day)
+        cached = BusCalendar._today
+        if cached is None or cached[0] != today:
+            cached = BusCalendar._today = (today, BusCalendar.lookup(today))
+        return cached[1]
 
     @staticmethod
     def initialize() -> None:
         """Read information about the service calendar from
         the calendar_dates.txt file"""
-        BusCalendar._calendar = defaultdict(set)
-        with open(
-            _RESOURCES_PATH("calendar_dates.txt"),
-            "r",
-            encoding="utf-8",
-        ) as f:
-            index = 0
-            for line in f:
-                index += 1
-                if index == 1:
-                    # Ignore first line
-                    continue
-                line = line.strip()
-                if not line:
+        calendar: Dict[int, Set[str]] = dict()
+        with _open_gtfs("calendar_dates.txt") as f:
+            reader = csv.reader(f)
+            # Ignore first line
+            next(reader, None)
+            for df in reader:
+                if not df:
                     continue
                 try:
                     # Format is:
                     # service_id,date,exception_type
-                    df = line.split(",")
                     assert len(df) == 3
-                    d = df[1].strip()
-                    year = int(d[0:4])
-                    month = int(d[4:6])
-                    day = int(d[6:8])
-                    assert 2000 <= year <= 2100
-                    assert 1 <= month <= 12
-                    assert 1 <= day <= 31
+                    # The date is in the form yyyymmdd, which we use
+                    # directly as an integer key
+                    d = int(df[1].strip()[0:8])
                     # Add this service id to the set of services that are active
                     # on the indicated date
-                    BusCalendar._calendar[date(year, month, day)].add(df[0].strip())
+                    calendar.setdefault(d, set()).add(sys.intern(df[0].strip()))
                 except (ValueError, AssertionError):
+                    line = ",".join(df)
                     logging.error(f"Error decoding calendar_dates.txt:\n'{line}'")
                     continue
+        # The calendar is read-only from here on
+        BusCalendar._calendar = {d: frozenset(s) for d, s in calendar.items()}
+        BusCalendar._today = None
+        _active_services_cached.cache_clear()
 
 
 class BusTrip:
@@ -278,7 +430,37 @@ class BusTrip:
     spanning several Stops that are visited at points in time given
     in Halts."""
 
+    __slots__ = (
+        "_id",
+        "_route_id",
+        "_headsign",
+        "_short_name",
+        "_direction",
+        "_block",
+        "_halts",
+        "_stops",
+        "_consecutive_stops",
+        "_stop_positions",
+        "_sorted_halts",
+        "_halt_seqs",
+        "_halt_secs",
+        "_halt_stop_names",
+        "_first_stop",
+        "_last_stop_seq",
+        "_last_stop",
+        "_start_secs",
+        "_end_secs",
+    )
+
     _all_trips: Dict[str, "BusTrip"] = dict()
+    # Canonical instances of the stop sets of trips, which are
+    # shared between the many trips that visit the same stops
+    _stop_sets: Dict[FrozenSet[str], FrozenSet[str]] = dict()
+    _consecutive_stop_sets: Dict[
+        FrozenSet[Tuple[str, str]], FrozenSet[Tuple[str, str]]
+    ] = dict()
+    # Stop position dicts, shared between trips with identical stop sequences
+    _stop_position_maps: Dict[Tuple[str, ...], Dict[str, List[int]]] = dict()
 
     def __init__(
         self,
@@ -297,20 +479,31 @@ class BusTrip:
         self._short_name = short_name
         self._direction = direction
         self._block = block
-        self._halts: Dict[HmsTuple, List["BusHalt"]] = defaultdict(list)
+        # Dict of halts keyed by arrival time, built on first access
+        self._halts: Optional[Dict[HmsTuple, List["BusHalt"]]] = None
         # Set of stop_ids visited on this trip
-        self._stops: Set[str] = set()
+        self._stops: FrozenSet[str] = frozenset()
         # Set of tuples: (stop, next_stop) for all consecutive stops on this trip
-        self._consecutive_stops: Set[Tuple[str, str]] = set()
-        # Cache a sorted list of halts and arrival times for this trip
-        self._sorted_halts: Optional[List[Tuple[HmsTuple, "BusHalt"]]] = None
+        self._consecutive_stops: FrozenSet[Tuple[str, str]] = frozenset()
+        # Dict of stop_id -> ascending list of the positions of its halts
+        # within the sorted halt list, built by _initialize()
+        self._stop_positions: Dict[str, List[int]] = dict()
+        # List of halts and arrival times for this trip, kept sorted
+        # by stop sequence as halts are added, along with a parallel
+        # list of the stop sequence numbers
+        self._sorted_halts: List[Tuple[HmsTuple, "BusHalt"]] = []
+        self._halt_seqs: List[int] = []
+        # Columns of arrival times (seconds since midnight) and stop names
+        # of the halts in sequence order, filled in by _initialize()
+        self._halt_secs = array("i")
+        self._halt_stop_names: Tuple[Optional[str], ...] = ()
         # Store the first and last stop ids for this trip
         self._first_stop: Optional[BusStop] = None
         self._last_stop_seq = 0
         self._last_stop: Optional[BusStop] = None
-        # Store the start and end times for this trip, as (h, m, s) tuples
-        self._start_time: Optional[HmsTuple] = None
-        self._end_time: Optional[HmsTuple] = None
+        # Store the start and end times for this trip, as seconds since midnight
+        self._start_secs: Optional[int] = None
+        self._end_secs: Optional[int] = None
         # Accumulate a singleton database of all trips
         BusTrip._all_trips[self._id] = self
 
@@ -318,6 +511,9 @@ class BusTrip:
     def clear(cls) -> None:
         """Clear all trips"""
         cls._all_trips = dict()
+        cls._stop_sets = dict()
+        cls._consecutive_stop_sets = dict()
+        cls._stop_position_maps = dict()
 
     @classmethod
     def initialize(cls) -> None:
@@ -327,16 +523,28 @@ class BusTrip:
 
     def _initialize(self) -> None:
         """Perform initialization after all trips have been created"""
-        # Calculate and cache the list of sorted halts, in sequence order
-        h: List[Tuple[HmsTuple, "BusHalt"]] = []
-        for hms, halts in self._halts.items():
-            for halt in halts:
-                h.append((hms, halt))
-        h.sort(key=lambda item: item[1].stop_seq)
-        self._sorted_halts = h
+        h = self._sorted_halts
+        self._halt_secs = array("i", (halt._arrival_secs for _, halt in h))
+        self._halt_stop_names = tuple(halt._stop_name for _, halt in h)
+        # Collect the stop_ids of the (known) stops visited
+        stops = frozenset(halt.stop_id for _, halt in h if halt.stop is not None)
+        self._stops = BusTrip._stop_sets.setdefault(stops, stops)
         # Collect tuples of consecutive stops
-        for ix in range(len(h) - 1):
-            self._consecutive_stops.add((h[ix][1].stop_id, h[ix + 1][1].stop_id))
+        consecutive_stops = frozenset(
+            (h[ix][1].stop_id, h[ix + 1][1].stop_id) for ix in range(len(h) - 1)
+        )
+        self._consecutive_stops = BusTrip._consecutive_stop_sets.setdefault(
+            consecutive_stops, consecutive_stops
+        )
+        # Index the positions of each stop within the sorted halts
+        sequence = tuple(halt.stop_id for _, halt in h)
+        positions = BusTrip._stop_position_maps.get(sequence)
+        if positions is None:
+            positions = dict()
+            for ix, stop_id in enumerate(sequence):
+                positions.setdefault(stop_id, []).append(ix)
+            BusTrip._stop_position_maps[sequence] = positions
+        self._stop_positions = positions
 
     @property
     def trip_id(self) -> str:
@@ -347,10 +555,16 @@ class BusTrip:
         """Returns a dictionary of BusHalts on this trip,
         keyed by arrival time (h, m, s), with each value
         being a list of BusHalt instances"""
+        if self._halts is None:
+            halts: Dict[HmsTuple, List["BusHalt"]] = dict()
+            for arrival, halt in self._sorted_halts:
+                # Note: there may be multiple halts at the same time!
+                halts.setdefault(arrival, []).append(halt)
+            self._halts = halts
         return self._halts
 
     @property
-    def stops(self) -> Set[str]:
+    def stops(self) -> FrozenSet[str]:
         """Returns a set of stop_ids visited in this trip"""
         return self._stops
 
@@ -365,9 +579,14 @@ class BusTrip:
     @property
     def sorted_halts(self) -> List[Tuple[HmsTuple, "BusHalt"]]:
         """Returns a list of BusHalts on this trip, sorted by stop sequence"""
-        assert self._sorted_halts is not None
         return self._sorted_halts
 
+    def iter_halts_fast(self) -> Iterator[Tuple[int, int, int, Optional[str]]]:
+        """Yield (h, m, s, stop_name) for the halts on this trip, in stop
+        sequence order, without touching the BusHalt and BusStop objects"""
+        for secs, stop_name in zip(self._halt_secs, self._halt_stop_names):
+            yield secs // 3600, secs // 60 % 60, secs % 60, stop_name
+
     def has_consecutive_stops(self, stop1_id: str, stop2_id: str) -> bool:
         """Returns True if the trip includes the two given stops,
         consecutively"""
@@ -384,23 +603,23 @@ class BusTrip:
         looking for stop_id. If found, return the base halt,
         the next halt after it, and the found halt,
         or (None, None, None) otherwise."""
-        halts = self._sorted_halts or []
-        for ix, (_, halt) in enumerate(halts):
-            if base_stop_id == halt.stop_id:
-                # Found the base stop
-                break
-        else:
+        positions = self._stop_positions
+        base_positions = positions.get(base_stop_id)
+        if not base_positions:
             # Did not find the base stop: return None
             return None, None, None
-        # Scan subsequent halts for a stop that is in the given set
-        ix += 1
-        next_halt = halts[ix][1] if ix < len(halts) else None
-        while ix < len(halts):
-            if stop_id == halts[ix][1].stop_id:
-                # Found it: return the base halt and the found halt
-                return halt, next_halt, halts[ix][1]
-            ix += 1
-        return None, None, None
+        stop_positions = positions.get(stop_id)
+        if not stop_positions:
+            return None, None, None
+        # Find the first halt at stop_id after the first halt at the base stop
+        ix = base_positions[0]
+        k = bisect_right(stop_positions, ix)
+        if k == len(stop_positions):
+            return None, None, None
+        halts = self._sorted_halts
+        next_halt = halts[ix + 1][1] if ix + 1 < len(halts) else None
+        # Found it: return the base halt, the next halt and the found halt
+        return halts[ix][1], next_halt, halts[stop_positions[k]][1]
 
     @property
     def direction(self) -> str:
@@ -422,14 +641,14 @@ class BusTrip:
     @property
     def start_time(self) -> HmsTuple:
         """The start time of this trip"""
-        assert self._start_time is not None
-        return self._start_time
+        assert self._start_secs is not None
+        return _unpack_hms(self._start_secs)
 
     @property
     def end_time(self) -> HmsTuple:
         """The end time of this trip"""
-        assert self._end_time is not None
-        return self._end_time
+        assert self._end_secs is not None
+        return _unpack_hms(self._end_secs)
 
     @property
     def route_id(self) -> str:
@@ -451,11 +670,18 @@ class BusTrip:
 
     def _add_halt(self, halt: "BusHalt") -> None:
         """Add a halt to this trip"""
-        # Index by arrival time
         arrival = halt.arrival_time
-        departure = halt.departure_time
-        # Note: there may be multiple halts at the same time!
-        self._halts[arrival].append(halt)
+        # Insert the halt into the list sorted by stop sequence. Halts are
+        # usually added in sequence order, in which case this is an append.
+        seq = halt.stop_seq
+        seqs = self._halt_seqs
+        if not seqs or seq >= seqs[-1]:
+            seqs.append(seq)
+            self._sorted_halts.append((arrival, halt))
+        else:
+            ix = bisect_right(seqs, seq)
+            seqs.insert(ix, seq)
+            self._sorted_halts.insert(ix, (arrival, halt))
         if halt.stop_seq == 1:
             # This is the first stop in the trip
             self._first_stop = halt.stop
@@ -463,14 +689,14 @@ class BusTrip:
             # This is, so far, the last stop in the trip
             self._last_stop = halt.stop
             self._last_stop_seq = halt.stop_seq
-        # Add the stop_id to the set of visited stops
-        if halt.stop is not None:
-            self._stops.add(halt.stop.stop_id)
         # Note the time span (start and end times) for this trip
-        if self._start_time is None or self._start_time > arrival:
-            self._start_time = arrival
-        if self._end_time is None or self._end_time < departure:
-            self._end_time = departure
+        # (the departure time is not presently implemented, and is
+        # identical to the arrival time)
+        secs = halt._arrival_secs
+        if self._start_secs is None or self._start_secs > secs:
+            self._start_secs = secs
+        if self._end_secs is None or self._end_secs < secs:
+            self._end_secs = secs
 
     @staticmethod
     def add_halt(trip_id: str, halt: "BusHalt") -> None:
@@ -485,18 +711,27 @@ class BusService:
     """A BusService encapsulates a set of trips on a BusRoute that can be
     active on a particular date, as determined by a BusCalendar"""
 
+    __slots__ = ("_id", "_trips", "_service", "_ordered_trips")
+
     _all_services: Dict[str, "BusService"] = dict()
+    # Decoded schedule strings, keyed by the nonunique service id,
+    # which is shared by many services on different routes
+    _schedules: Dict[str, str] = dict()
 
     def __init__(self, service_id: str) -> None:
         # The service id is a route id + '/' + a nonunique service id
         try:
             self._id = service_id
             self._trips: Dict[str, BusTrip] = dict()
-            schedule = service_id.split("/")[1]
-            if schedule.startswith("vmh_"):
-                # The schedule string contains a prefix such as "vmh_"
-                # (we have no clue what that means)
-                schedule = schedule[4:]
+            suffix = service_id.split("/")[1]
+            schedule = BusService._schedules.get(suffix)
+            if schedule is None:
+                schedule = suffix
+                if schedule.startswith("vmh_"):
+                    # The schedule string contains a prefix such as "vmh_"
+                    # (we have no clue what that means)
+                    schedule = sys.intern(schedule[4:])
+                BusService._schedules[suffix] = schedule
             self._service = schedule
             # Decode year, month, date
             # self._valid_from = date(
@@ -520,6 +755,7 @@ class BusService:
     def clear() -> None:
         """Clear all services"""
         BusService._all_services = dict()
+        BusService._schedules = dict()
 
     @staticmethod
     def initialize() -> None:
@@ -530,8 +766,9 @@ class BusService:
     def _initialize(self) -> None:
         """Complete initialization of this service"""
 
-        def keyfunc(trip: BusTrip) -> HmsTuple:
-            return trip.start_time
+        def keyfunc(trip: BusTrip) -> int:
+            assert trip._start_secs is not None
+            return trip._start_secs
 
         self._ordered_trips = sorted(self._trips.values(), key=keyfunc)
 
@@ -571,6 +808,32 @@ class BusService:
         self._trips[trip.trip_id] = trip
 
 
+@functools.lru_cache(maxsize=4096)
+def _active_services_cached(route_id: str, on_date: date) -> Tuple[BusService, ...]:
+    """Return a tuple of the services on the given route that are active
+    on the given date. The result is cached until the calendar or the
+    routes are re-initialized."""
+    route = BusRoute.lookup(route_id)
+    if route is None:
+        return ()
+    return tuple(s for s in route._services.values() if s.is_active_on_date(on_date))
+
+
+@functools.lru_cache(maxsize=1024)
+def _route_id_cached(
+    route_number: str, area_priority: Tuple[str, ...]
+) -> Optional[str]:
+    """Return the id of the route having the given number, in the first
+    area in area_priority where such a route exists. The result is cached
+    until the routes are re-initialized."""
+    routes = BusRoute._all_routes
+    for area in area_priority:
+        route_id = area + "." + route_number
+        if route_id in routes:
+            return route_id
+    return None
+
+
 class BusRoute:
 
     """A BusRoute has one or more BusServices serving it.
@@ -578,7 +841,11 @@ class BusRoute:
     Each BusTrip involves a number of BusStops, via a number
     of BusHalts."""
 
+    __slots__ = ("_id", "_area", "_number", "_services")
+
     _all_routes: Dict[str, "BusRoute"] = dict()
+    # Routes sorted by identifier, computed on first use
+    _sorted_routes: Optional[Tuple["BusRoute", ...]] = None
 
     def __init__(self, route_id: str) -> None:
         # We store the long-form route_id, i.e. 'ST.1' for route 1
@@ -593,10 +860,16 @@ class BusRoute:
             "route_id " + route_id + " already exists"
         )
         BusRoute._all_routes[route_id] = self
+        # Invalidate the sorted route cache
+        BusRoute._sorted_routes = None
 
     def add_service(self, service: BusService) -> None:
         """Add a service to this route"""
-        self._services[service.service_id] = service
+        service_id = service.service_id
+        if self._services.get(service_id) is not service:
+            self._services[service_id] = service
+            # The active services of this route have changed
+            _active_services_cached.cache_clear()
 
     def active_services(self, on_date: Optional[date]) -> List[BusService]:
         """Returns a list of the services on this route
@@ -604,12 +877,17 @@ class BusRoute:
         if on_date is None:
             now = utcnow()
             on_date = date(now.year, now.month, now.day)
-        return [s for s in self._services.values() if s.is_active_on_date(on_date)]
+        return list(_active_services_cached(self._id, on_date))
 
-    def active_services_today(self) -> List[BusService]:
+    def active_services_today(
+        self, now: Optional[datetime] = None
+    ) -> List[BusService]:
         """Returns a list of the services on this route
-        that are active today, based on UTC (Icelandic time)"""
-        return self.active_services(None)
+        that are active today, based on UTC (Icelandic time).
+        Callers can pass in the current time, if they already have it."""
+        if now is None:
+            return self.active_services(None)
+        return self.active_services(date(now.year, now.month, now.day))
 
     def __str__(self):
         return "Route {0} with {1} services, of which {2} are active today".format(
@@ -634,12 +912,7 @@ class BusRoute:
     ) -> Optional[BusRoute]:
         """Return the route having the given number"""
         assert "." not in route_number
-        for area in area_priority:
-            route_id = area + "." + route_number
-            route = BusRoute._all_routes.get(route_id)
-            if route is not None:
-                return route
-        return None
+        return BusRoute.lookup(_route_id_cached(route_number, tuple(area_priority)))
 
     @staticmethod
     def make_id(
@@ -647,8 +920,8 @@ class BusRoute:
     ) -> Optional[str]:
         """Return the full id for the route having the given number, assuming
         the indicated area priority"""
-        route = BusRoute.lookup_number(route_number, area_priority=area_priority)
-        return None if route is None else route.route_id
+        assert "." not in route_number
+        return _route_id_cached(route_number, tuple(area_priority))
 
     @staticmethod
     def lookup(route_id: Optional[str]) -> Optional[BusRoute]:
@@ -663,44 +936,76 @@ class BusRoute:
         """Return a dictionary of all routes, keyed by identifier"""
         return BusRoute._all_routes
 
+    @staticmethod
+    def sorted_routes() -> Tuple[BusRoute, ...]:
+        """Return a tuple of all routes, sorted by identifier"""
+        if BusRoute._sorted_routes is None:
+            BusRoute._sorted_routes = tuple(
+                route for _, route in sorted(BusRoute._all_routes.items())
+            )
+        return BusRoute._sorted_routes
+
     @staticmethod
     def initialize() -> None:
         """Read information about bus routes from the trips.txt file"""
         BusRoute._all_routes = dict()
+        BusRoute._sorted_routes = None
         BusService.clear()
         BusTrip.clear()
-        with open(_RESOURCES_PATH("trips.txt"), "r", encoding="utf-8") as f:
-            index = 0
-            for line in f:
-                index += 1
-                if index == 1:
-                    # Ignore first line
-                    continue
-                line = line.strip()
-                if not line:
+        with _open_gtfs("trips.txt") as f:
+            reader = csv.reader(f)
+            # Ignore first line
+            next(reader, None)
+            for s in reader:
+                if not s:
                     continue
                 # Format is:
                 # route_id,service_id,trip_id,trip_headsign,trip_short_name,
                 # direction_id,block_id,shape_id,wheelchair_accessible,bikes_allowed
-                s = line.split(",")
                 assert len(s) >= 7
                 # Break 'ST.17' into components area='ST' and number='17'
-                route_id = s[0]
+                # Identifiers are interned, since they are used
+                # repeatedly as dictionary keys
+                route_id = sys.intern(s[0])
                 route = BusRoute.lookup(route_id) or BusRoute(route_id)
                 # Make a unique service id out of the route id
                 # plus the non-unique service id
-                service = BusService.lookup(route_id + "/" + s[1])
+                service = BusService.lookup(sys.intern(route_id + "/" + s[1]))
                 route.add_service(service)
                 trip = BusTrip(
-                    trip_id=s[2],
+                    trip_id=sys.intern(s[2]),
                     route_id=route_id,
                     headsign=s[3],
                     short_name=s[4],
-                    direction=s[5],
+                    direction=sys.intern(s[5]),
                     block=s[6],
                 )
                 # We don't use shape_id, f[7], for now
                 service.add_trip(trip)
+        # Route ids and active services may have been looked up
+        # while the routes were being read
+        _route_id_cached.cache_clear()
+        _active_services_cached.cache_clear()
+
+
+@functools.lru_cache(maxsize=4096)
+def _closest_stops_cached(
+    location: LatLonTuple, n: int, within_radius: Optional[float]
+) -> Tuple[str, ...]:
+    """Return a tuple of the ids of the n stops closest to the given
+    (rounded) location. The result is cached until the stops are
+    re-initialized."""
+    return tuple(
+        stop._id for stop in BusStop._closest_to_list(location, n, within_radius)
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _named_fuzzy_cached(name: str) -> Tuple[str, ...]:
+    """Return a tuple of the ids of the stops that match the given name,
+    using fuzzy matching. The result is cached until the stops are
+    re-initialized."""
+    return tuple(BusStop._named_fuzzy(name))
 
 
 class BusStop:
@@ -708,23 +1013,47 @@ class BusStop:
     """A BusStop is a place at a particular location where one or more
     buses stop on their trips."""
 
+    __slots__ = (
+        "_id",
+        "_name",
+        "_skey",
+        "_location",
+        "_lat_rad",
+        "_lon_rad",
+        "_cos_lat",
+        "_visits",
+    )
+
     _all_stops: Dict[str, BusStop] = dict()
-    _all_stops_by_name: DefaultDict[str, List["BusStop"]] = defaultdict(list)
+    _all_stops_by_name: Dict[str, List["BusStop"]] = dict()
+    # Struct-of-arrays view of all stops, built by BusStop.initialize():
+    # latitudes and longitudes in radians, and the corresponding stops
+    _lats: array = array("d")
+    _lons: array = array("d")
+    _cos_lats: array = array("d")
+    _stop_index: List["BusStop"] = []
+    # Spatial index: (lat, lon) grid cell -> list of indices into the above
+    _grid: Dict[Tuple[int, int], List[int]] = dict()
+    # Word index: word in a lowercase stop name or voice name -> set of stop names
+    _word_index: Dict[str, Set[str]] = dict()
 
     def __init__(self, stop_id: str, name: str, location: LatLonTuple):
         self._id = stop_id
         self._name = name
         # Search key for this stop: lowercase, no hyphens or slashes
-        self._skey = (
-            name.lower().replace("-", " ").replace("/", " ").replace("   ", " ")
-        )
+        self._skey = _search_key(name)
         # Location is a tuple of (lat, lon)
         (lat, lon) = self._location = location
         assert -90.0 <= lat <= 90.0
         assert -180.0 <= lon <= 180.0
+        # Precompute the location in radians, and the cosine of the latitude,
+        # for distance calculations
+        self._lat_rad = math.radians(lat)
+        self._lon_rad = math.radians(lon)
+        self._cos_lat = math.cos(self._lat_rad)
         assert stop_id not in BusStop._all_stops
         BusStop._all_stops[stop_id] = self
-        BusStop._all_stops_by_name[name].append(self)
+        BusStop._all_stops_by_name.setdefault(name, []).append(self)
         # Dict of routes that visit this stop, with each
         # value being a set of directions
         self._visits: DefaultDict[str, Set[str]] = defaultdict(set)
@@ -748,60 +1077,165 @@ class BusStop:
         """Find the bus stop closest to the given location and return it,
         or a list of the closest stops if n > 1, but in any case only return
         stops that are within the given radius (in kilometers)."""
-        if n < 1:
+        if n < 1 or (within_radius is not None and within_radius < 0.0):
             return []
-        dist = [
-            (distance(location, stop.location), stop)
-            for stop in BusStop._all_stops.values()
+        # Round the location so that nearby queries share cache entries
+        location = (
+            round(location[0], _LOCATION_CACHE_DECIMALS),
+            round(location[1], _LOCATION_CACHE_DECIMALS),
+        )
+        all_stops = BusStop._all_stops
+        return [
+            all_stops[stop_id]
+            for stop_id in _closest_stops_cached(location, n, within_radius)
         ]
-        if within_radius is not None:
-            dist = [(d, stop) for d, stop in dist if d <= within_radius]
-        if not dist:
-            return []
-        # Sort on increasing distance
-        dist = sorted(dist, key=lambda t: t[0])
-        # Return the list
-        return [stop for _, stop in dist[0:n]]
+
+    @staticmethod
+    def _closest_to_list(
+        location: LatLonTuple, n: int, within_radius: Optional[float]
+    ) -> List["BusStop"]:
+        """Find the n bus stops closest to the given location, within
+        the given radius (in kilometers), if any"""
+        lat1 = math.radians(location[0])
+        lon1 = math.radians(location[1])
+        cos_lat1 = math.cos(lat1)
+        sin = math.sin
+        lats, lons, cos_lats = BusStop._lats, BusStop._lons, BusStop._cos_lats
+
+        def hav(ix: int) -> float:
+            """Return the Haversine term for the stop at index ix. The
+            great-circle distance is monotonic in this term, so we can
+            rank and filter on it without taking the arcsine."""
+            return (
+                sin((lats[ix] - lat1) * 0.5) ** 2
+                + cos_lat1 * cos_lats[ix] * sin((lons[ix] - lon1) * 0.5) ** 2
+            )
+
+        # Search within the given radius, or, if no radius is given, within
+        # an initial radius that is widened until at least n stops are found
+        radius = _GRID_SEARCH_RADIUS if within_radius is None else within_radius
+        while True:
+            candidates = BusStop._grid_candidates(location, radius)
+            if candidates is None:
+                # The search area is too large for the grid to help:
+                # scan all stops
+                found = [(hav(ix), ix) for ix in range(len(lats))]
+                if within_radius is None:
+                    break
+            else:
+                found = [(hav(ix), ix) for ix in candidates]
+            # Convert the radius to the corresponding Haversine term
+            half_angle = min(radius / (2 * _EARTH_RADIUS), math.pi / 2)
+            max_hav = math.sin(half_angle) ** 2
+            found = [t for t in found if t[0] <= max_hav]
+            if within_radius is not None or len(found) >= n:
+                break
+            radius *= 4
+        # Select the n closest stops without sorting the full list
+        stop_index = BusStop._stop_index
+        return [stop_index[ix] for _, ix in heapq.nsmallest(n, found)]
+
+    @staticmethod
+    def _grid_candidates(location: LatLonTuple, radius: float) -> Optional[List[int]]:
+        """Return a sorted list of the indices of all stops in grid cells that
+        overlap the bounding box of a circle with the given radius (in km)
+        around the location, or None if the box is too large for the grid
+        to be of use"""
+        angle = radius / _EARTH_RADIUS
+        lat, lon = location
+        cos_lat = math.cos(math.radians(lat))
+        if angle >= math.pi / 2 or math.sin(angle) >= cos_lat:
+            # The circle includes a pole
+            return None
+        dlat = math.degrees(angle)
+        dlon = math.degrees(math.asin(math.sin(angle) / cos_lat))
+        i0 = math.floor((lat - dlat) / _GRID_CELL_SIZE)
+        i1 = math.floor((lat + dlat) / _GRID_CELL_SIZE)
+        j0 = math.floor((lon - dlon) / _GRID_CELL_SIZE)
+        j1 = math.floor((lon + dlon) / _GRID_CELL_SIZE)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > _GRID_MAX_CELLS:
+            return None
+        grid = BusStop._grid
+        result: List[int] = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                cell = grid.get((i, j))
+                if cell is not None:
+                    result.extend(cell)
+        # Keep the stops in their original order, for consistent tie-breaking
+        result.sort()
+        return result
 
     @staticmethod
     def named(name: str, *, fuzzy: bool = False) -> List[BusStop]:
         """Return all bus stops with the given name,
         optionally using fuzzy matching"""
-        stops = BusStop._all_stops_by_name.get(name, [])
         if not fuzzy:
             # No fuzzy stuff: we're done
-            return stops
-        # Continue, this time with fuzzier criteria:
+            return BusStop._all_stops_by_name.get(name, [])
+        all_stops = BusStop._all_stops
+        return [all_stops[stop_id] for stop_id in _named_fuzzy_cached(name)]
+
+    @staticmethod
+    def _named_fuzzy(name: str) -> Set[str]:
+        """Return the ids of all bus stops with the given name, or
+        containing it as a whole word, using lower case matching"""
+        stops = BusStop._all_stops_by_name.get(name, [])
+        # Start with the exact matches, then continue with fuzzier criteria:
         # match any stop name containing the given string as a
         # whole word, using lower case matching
-        # Note the stops we already have in the result list
         stop_ids = set(stop.stop_id for stop in stops)
-        nlower = name.lower().replace("-", " ").replace("   ", " ")
+        nlower = _search_key(name)
+        # A whole-word match implies that every word in the search string
+        # is also a word in the stop name (or its voice version), so we
+        # only need to check the names that contain all of those words
+        candidates: Iterable[str]
+        words = _WORD_RE.findall(nlower)
+        if words:
+            index = BusStop._word_index
+            word_sets = sorted((index.get(w) or set() for w in words), key=len)
+            candidates = word_sets[0].intersection(*word_sets[1:])
+        else:
+            candidates = BusStop._all_stops_by_name.keys()
+        # Only run the whole-word pattern on names that contain
+        # the search string as a substring
+        pattern = _whole_word_pattern(nlower)
         match: Union[None, bool, Match[str]]
-        for stop_name, stops in BusStop._all_stops_by_name.items():
+        for stop_name in candidates:
+            stops = BusStop._all_stops_by_name[stop_name]
             stop = stops[0]
-            match = re.search(r"\b" + nlower + r"\b", stop._skey)
+            skey = stop._skey
+            match = nlower in skey and pattern.search(skey)
             if not match:
                 # Try the voice version, if different
-                voice_key = _VOICE_NAMES.get(stop_name)
-                match = voice_key is not None and re.search(
-                    r"\b" + nlower + r"\b", voice_key.lower()
+                voice_key = _VOICE_KEYS.get(stop_name)
+                match = (
+                    voice_key is not None
+                    and nlower in voice_key
+                    and pattern.search(voice_key)
                 )
             if not match:
                 continue
             stop_ids |= set(stop.stop_id for stop in stops)
-        result: List[BusStop] = []
-        for stop_id in stop_ids:
-            bstop = BusStop.lookup(stop_id)
-            if bstop is not None:
-                result.append(bstop)
-        return result
+        return stop_ids
 
     @staticmethod
     def sort_by_proximity(stops: List[BusStop], location: LatLonTuple) -> None:
         """Sort a list of bus stops by increasing distance from the
         given location"""
-        stops.sort(key=lambda stop: distance(location, stop.location))
+        lat1_rad = math.radians(location[0])
+        lon1_rad = math.radians(location[1])
+        cos_lat1 = math.cos(lat1_rad)
+        stops.sort(key=lambda stop: stop._hav_from(lat1_rad, cos_lat1, lon1_rad))
+
+    def _hav_from(self, lat1_rad: float, cos_lat1: float, lon1_rad: float) -> float:
+        """Return the Haversine term for the distance from a location, given
+        in radians along with the cosine of its latitude, to this stop.
+        The distance is monotonic in this term, so it can be used for
+        ranking stops without taking the square root and the arctangent."""
+        slat = math.sin((self._lat_rad - lat1_rad) * 0.5)
+        slon = math.sin((self._lon_rad - lon1_rad) * 0.5)
+        return slat * slat + cos_lat1 * self._cos_lat * slon * slon
 
     @staticmethod
     def voice(stop_name: str) -> str:
@@ -848,28 +1282,51 @@ class BusStop:
     def initialize() -> None:
         """Read information about bus stops from the stops.txt file"""
         BusStop._all_stops = dict()
-        BusStop._all_stops_by_name = defaultdict(list)
-        with open(_RESOURCES_PATH("stops.txt"), "r", encoding="utf-8") as f:
-            index = 0
-            for line in f:
-                index += 1
-                if index == 1:
-                    # Ignore first line
-                    continue
-                line = line.strip()
-                if not line:
+        BusStop._all_stops_by_name = dict()
+        with _open_gtfs("stops.txt") as f:
+            reader = csv.reader(f)
+            # Ignore first line
+            next(reader, None)
+            for df in reader:
+                if not df:
                     continue
                 # Format is:
                 # stop_id,stop_name,stop_lat,stop_lon,location_type
-                df = line.split(",")
                 assert len(df) >= 4
-                stop_id = df[0].strip()
+                stop_id = sys.intern(df[0].strip())
                 assert stop_id not in BusStop._all_stops
                 BusStop(
                     stop_id=stop_id,
-                    name=df[1].strip(),
+                    name=sys.intern(df[1].strip()),
                     location=(float(df[2]), float(df[3])),
                 )
+        # Build the struct-of-arrays view used by closest_to_list()
+        stops = list(BusStop._all_stops.values())
+        BusStop._lats = array("d", (stop._lat_rad for stop in stops))
+        BusStop._lons = array("d", (stop._lon_rad for stop in stops))
+        BusStop._cos_lats = array("d", (stop._cos_lat for stop in stops))
+        BusStop._stop_index = stops
+        grid: Dict[Tuple[int, int], List[int]] = dict()
+        for ix, stop in enumerate(stops):
+            lat, lon = stop._location
+            cell = (
+                math.floor(lat / _GRID_CELL_SIZE),
+                math.floor(lon / _GRID_CELL_SIZE),
+            )
+            grid.setdefault(cell, []).append(ix)
+        BusStop._grid = grid
+        # Build the word index used by named(fuzzy=True)
+        word_index: Dict[str, Set[str]] = dict()
+        for stop_name, stops in BusStop._all_stops_by_name.items():
+            words = set(_WORD_RE.findall(stops[0]._skey))
+            voice_key = _VOICE_KEYS.get(stop_name)
+            if voice_key is not None:
+                words.update(_WORD_RE.findall(voice_key))
+            for w in words:
+                word_index.setdefault(w, set()).add(stop_name)
+        BusStop._word_index = word_index
+        _closest_stops_cached.cache_clear()
+        _named_fuzzy_cached.cache_clear()
 
 
 class BusHalt:
@@ -877,15 +1334,28 @@ class BusHalt:
     """The scheduled arrival and departure of a bus at a particular stop
     on a particular trip"""
 
+    __slots__ = ("_trip_id", "_stop_id", "_stop_name", "_stop_seq", "_arrival_secs")
+
     def __init__(
-        self, trip_id: str, arrival_time: HmsTuple, stop_id: str, stop_sequence: int
+        self,
+        trip_id: str,
+        arrival_time: Union[int, HmsTuple],
+        stop_id: str,
+        stop_sequence: int,
     ) -> None:
+        """The arrival time can be given as an (h, m, s) tuple or
+        as an integer number of seconds since midnight"""
         self._trip_id = trip_id
         self._stop_id = stop_id
+        # Cache the name of the stop, for schedule construction
+        stop = BusStop.lookup(stop_id)
+        self._stop_name = None if stop is None else stop.name
         # The sequence number of this stop within its trip
         self._stop_seq = stop_sequence
-        # (h, m, s) tuple
-        self._arrival_time = arrival_time
+        # Arrival time, as seconds since midnight
+        if not isinstance(arrival_time, int):
+            arrival_time = _pack_hms(arrival_time)
+        self._arrival_secs = arrival_time
         # self._departure_time = departure_time
         # self._pickup_type = pickup_type
         # Create relationships to the trip and to the stop
@@ -896,18 +1366,15 @@ class BusHalt:
         """Return the time, in seconds, between this halt and the given one"""
         if halt is self:
             return 0
-        today = date.today()
-        t1 = datetime.combine(today, time(*self._arrival_time))
-        t2 = datetime.combine(today, time(*halt._arrival_time))
-        return (t2 - t1).total_seconds()
+        return float(halt._arrival_secs - self._arrival_secs)
 
     @property
     def arrival_time(self) -> HmsTuple:
-        return self._arrival_time
+        return _unpack_hms(self._arrival_secs)
 
     @property
     def departure_time(self) -> HmsTuple:
-        return self._arrival_time  # Not presently implemented
+        return self.arrival_time  # Not presently implemented
 
     @property
     def stop_seq(self) -> int:
@@ -921,6 +1388,10 @@ class BusHalt:
     def stop(self) -> Optional[BusStop]:
         return BusStop.lookup(self._stop_id)
 
+    @property
+    def stop_name(self) -> Optional[str]:
+        return self._stop_name
+
     @property
     def trip(self) -> Optional[BusTrip]:
         return BusTrip.lookup(self._trip_id)
@@ -939,32 +1410,33 @@ class BusHalt:
     def initialize() -> None:
         """Read information about bus halts from the stop_times.txt file"""
 
-        def to_hms(s: str) -> HmsTuple:
-            """Convert a hh:mm:ss string to a (h, m, s) tuple"""
-            return (int(s[0:2]), int(s[3:5]), int(s[6:8]))
-
-        with open(_RESOURCES_PATH("stop_times.txt"), "r", encoding="utf-8") as f:
-            index = 0
-            for line in f:
-                index += 1
-                if index == 1:
-                    # Ignore first line
-                    continue
-                line = line.strip()
-                if not line:
+        def to_secs(s: str) -> int:
+            """Convert a hh:mm:ss string to seconds since midnight"""
+            return int(s[0:2]) * 3600 + int(s[3:5]) * 60 + int(s[6:8])
+
+        with _open_gtfs("stop_times.txt") as f:
+            reader = csv.reader(f)
+            # Ignore first line
+            next(reader, None)
+            # Local bindings for the loop, which runs for every line
+            # of what is by far the largest file
+            intern = sys.intern
+            halt = BusHalt
+            for df in reader:
+                if not df:
                     continue
                 # Format is:
                 # trip_id,arrival_time,departure_time,stop_id,
                 # stop_sequence,stop_headsign,pickup_type,
                 # drop_off_type,shape_dist_traveled,timepoint,
                 # continuous_pickup,continuous_drop_off
-                df = line.split(",")
+                # (the csv reader removes the quotes around the times)
                 assert len(df) >= 5
-                BusHalt(
-                    df[0].strip(),  # trip_id
-                    to_hms(df[1].strip('"')),  # arrival_time
-                    # to_hms(df[2].strip()),  # departure_time
-                    df[3].strip(),  # stop_id
+                halt(
+                    intern(df[0].strip()),  # trip_id
+                    to_secs(df[1].strip()),  # arrival_time
+                    # to_secs(df[2].strip()),  # departure_time
+                    intern(df[3].strip()),  # stop_id
                     int(df[4]),  # stop_sequence
                     # Ignore stop_headsign
                 )
@@ -977,9 +1449,25 @@ class Bus:
     heading, its last or current stop, its next stop,
     and its status code."""
 
+    __slots__ = (
+        "_route_id",
+        "_stop_id",
+        "_next_stop_id",
+        "_location",
+        "_heading",
+        "_code",
+        "_timestamp",
+    )
+
     _all_buses: DefaultDict[str, List[Bus]] = defaultdict(list)
     _info_timestamp: Optional[datetime] = None
+    # Monotonic clock reading at the time of the last successful load
+    _info_monotonic: Optional[float] = None
     _lock = threading.Lock()
+    # Validators from the last complete status response, used to make
+    # conditional requests that the server can answer with 304 Not Modified
+    _last_modified: Optional[str] = None
+    _etag: Optional[str] = None
 
     def __init__(
         self,
@@ -992,18 +1480,19 @@ class Bus:
         code: int,
         timestamp: datetime,
     ) -> None:
-        assert "." in route_id
+        if __debug__:
+            # Sanity checks, skipped entirely when running with -O
+            lat, lon = location
+            assert "." in route_id
+            assert -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0
         self._route_id = route_id
         self._stop_id = stop_id
         self._next_stop_id = next_stop_id
         # Location is a tuple of (lat, lon)
-        (lat, lon) = self._location = location
-        assert -90.0 <= lat <= 90.0
-        assert -180.0 <= lon <= 180.0
+        self._location = location
         self._heading = heading
         self._code = code
         self._timestamp: datetime = timestamp
-        Bus._all_buses[route_id].append(self)
 
     @staticmethod
     def all_buses() -> DefaultDict[str, List[Bus]]:
@@ -1018,92 +1507,203 @@ class Bus:
         return Bus._all_buses.get(route_id, [])
 
     @staticmethod
-    def _fetch_state() -> Optional[ET.Element]:
-        """Fetch new state via HTTP"""
-        r = requests.get(_STATUS_URL) if _STATUS_URL else None
+    def _fetch_state() -> Optional[Iterable[ET.Element]]:
+        """Fetch new state via HTTP, returning an iterable of bus elements
+        that are parsed incrementally as the response is streamed in,
+        or _NOT_MODIFIED if the state has not changed since it was last
+        fetched"""
+        if not _STATUS_URL:
+            return None
+        headers: Dict[str, str] = dict()
+        if Bus._last_modified:
+            headers["If-Modified-Since"] = Bus._last_modified
+        if Bus._etag:
+            headers["If-None-Match"] = Bus._etag
+        try:
+            r = _session.get(
+                _STATUS_URL, headers=headers, stream=True, timeout=_STATUS_TIMEOUT
+            )
+        except requests.RequestException as e:
+            logging.warning(f"Exception {e} when fetching real-time bus status")
+            r = None
         # pylint: disable=no-member
         if r is not None and r.status_code == requests.codes.ok:
-            html_doc = r.text
-            return ET.fromstring(html_doc)
+            return Bus._stream_buses(r)
+        if r is not None:
+            r.close()
+            if r.status_code == requests.codes.not_modified and headers:
+                return _NOT_MODIFIED
+        # Whatever state we end up with will not be the one that the
+        # validators refer to, so the next request must be unconditional
+        Bus._last_modified = Bus._etag = None
         # State not available
         return None
 
     @staticmethod
-    def _read_state() -> Optional[ET.Element]:
+    def _stream_buses(r: requests.Response) -> Iterator[ET.Element]:
+        """Incrementally parse the bus status document in an HTTP response,
+        yielding each bus element and clearing it once it has been consumed"""
+        # Until the response has been parsed completely, the validators
+        # of the previous response no longer describe the state that we
+        # end up with, e.g. if the response is cut short
+        Bus._last_modified = Bus._etag = None
+        with r:
+            # Let urllib3 undo any gzip/deflate content encoding
+            r.raw.decode_content = True
+            yield from Bus._iter_buses(cast(IO[bytes], r.raw))
+        # The response has been parsed completely: subsequent requests
+        # can be conditional on the state having changed
+        Bus._last_modified = r.headers.get("Last-Modified")
+        Bus._etag = r.headers.get("ETag")
+
+    @staticmethod
+    def _iter_buses(f: IO[bytes]) -> Iterator[ET.Element]:
+        """Incrementally parse a bus status document from a binary stream,
+        yielding each bus element and clearing it once it has been consumed"""
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag == "bus":
+                yield elem
+                elem.clear()
+
+    @staticmethod
+    def _read_state() -> Optional[Iterable[ET.Element]]:
         """As a fallback, attempt to read bus real-time data from status file"""
         try:
-            return ET.parse(_STATUS_FILE).getroot()
+            f = open(_STATUS_FILE, "rb")
         except FileNotFoundError:
             return None
+        return Bus._read_buses(f)
+
+    @staticmethod
+    def _read_buses(f: IO[bytes]) -> Iterator[ET.Element]:
+        """Incrementally parse the bus status document in an open file,
+        closing the file when done"""
+        with f:
+            yield from Bus._iter_buses(f)
 
     @staticmethod
     def _load_state() -> None:
         """Loads a fresh state of all buses from the web"""
-        # Clear previous state
-        Bus._all_buses = defaultdict(list)
         # Attempt to fetch state via HTTP
-        root = Bus._fetch_state()
-        if root is None:
+        buses = Bus._fetch_state()
+        if buses is _NOT_MODIFIED:
+            # The state has not changed since we last fetched it:
+            # keep the buses that we already have
+            Bus._info_timestamp = utcnow()
+            Bus._info_monotonic = monotonic()
+            return
+        all_buses = None if buses is None else Bus._parse_buses(buses)
+        if all_buses is None:
             # Fall back to reading state from file
-            root = Bus._read_state()
-        if root is None:
-            # State is not available
+            fallback = Bus._read_state()
+            if fallback is not None:
+                all_buses = Bus._parse_buses(fallback)
+            elif buses is None:
+                # State is not available: clear the previous state
+                Bus._all_buses = defaultdict(list)
+                return
+        if all_buses is None:
+            # The state could not be read in full: keep the buses that
+            # we already have, and try again at the next refresh
             return
-        for bus in root.findall("bus"):
-            ts = bus.get("time")
-            if not ts or len(ts) < 12:
-                continue
-            dt = datetime(
-                year=2000 + int(ts[0:2]),
-                month=int(ts[2:4]),
-                day=int(ts[4:6]),
-                hour=int(ts[6:8]),
-                minute=int(ts[8:10]),
-                second=int(ts[10:12]),
-            )
-            lat = float(bus.get("lat") or 0.0)
-            lon = float(bus.get("lon") or 0.0)
-            heading = float(bus.get("head") or 0.0)
-            route_id = bus.get("route")
-            if not route_id:
-                continue
-            # Convert area indicators
-            # !!! TODO: This needs to be verified further, and the 'SA' area added
-            if route_id.startswith("A"):
-                route_id = "AF." + route_id[1:]
-            elif route_id.startswith("R"):
-                route_id = "RY." + route_id[1:]
-            else:
-                assert route_id[0] in "123456789"
-                # Assume capital area
-                route_id = "ST." + route_id
-            stop_id = bus.get("stop")
-            next_stop_id = bus.get("next")
-            if not stop_id or not next_stop_id:
-                continue
-            code = int(bus.get("code") or 0)
-            Bus(
-                route_id=route_id,
-                location=(lat, lon),
-                stop_id=stop_id,
-                next_stop_id=next_stop_id,
-                heading=heading,
-                code=code,
-                timestamp=dt,
-            )
+        # Publish the new state once it is complete, since other
+        # threads may be reading the previous state meanwhile
+        Bus._all_buses = all_buses
         Bus._info_timestamp = utcnow()
+        Bus._info_monotonic = monotonic()
+
+    @staticmethod
+    def _parse_buses(
+        buses: Iterable[ET.Element],
+    ) -> Optional[DefaultDict[str, List[Bus]]]:
+        """Build a dict of lists of buses, keyed by route id, from an iterable
+        of bus elements, or return None if the document is cut short or
+        malformed partway through"""
+        all_buses: DefaultDict[str, List[Bus]] = defaultdict(list)
+        utc = timezone.utc
+        try:
+            for bus in buses:
+                # Fetch the attribute dict once, and look up attributes in it
+                get = bus.attrib.get
+                ts = get("time")
+                if not ts or len(ts) < 12:
+                    continue
+                # The timestamp is of the form yymmddHHMMSS, in Icelandic time,
+                # which is UTC: split it into fields by integer division
+                n, second = divmod(int(ts[0:12]), 100)
+                n, minute = divmod(n, 100)
+                n, hour = divmod(n, 100)
+                n, day = divmod(n, 100)
+                year, month = divmod(n, 100)
+                dt = datetime(
+                    2000 + year, month, day, hour, minute, second, tzinfo=utc
+                )
+                lat = float(get("lat") or 0.0)
+                lon = float(get("lon") or 0.0)
+                heading = float(get("head") or 0.0)
+                route_id = get("route")
+                if not route_id:
+                    continue
+                # Convert area indicators
+                # !!! TODO: This needs to be verified further,
+                # !!! and the 'SA' area added
+                if route_id.startswith("A"):
+                    route_id = "AF." + route_id[1:]
+                elif route_id.startswith("R"):
+                    route_id = "RY." + route_id[1:]
+                else:
+                    assert route_id[0] in "123456789"
+                    # Assume capital area
+                    route_id = "ST." + route_id
+                route_id = sys.intern(route_id)
+                stop_id = get("stop")
+                next_stop_id = get("next")
+                if not stop_id or not next_stop_id:
+                    continue
+                stop_id = sys.intern(stop_id)
+                next_stop_id = sys.intern(next_stop_id)
+                code = int(get("code") or 0)
+                all_buses[route_id].append(
+                    Bus(
+                        route_id=route_id,
+                        location=(lat, lon),
+                        stop_id=stop_id,
+                        next_stop_id=next_stop_id,
+                        heading=heading,
+                        code=code,
+                        timestamp=dt,
+                    )
+                )
+        except (ET.ParseError, Urllib3Error, OSError) as e:
+            logging.warning(f"Exception {e} when reading real-time bus status")
+            return None
+        return all_buses
 
     @staticmethod
     def refresh_state() -> None:
         """Load a new state, if required"""
-        with Bus._lock:
-            if Bus._info_timestamp is not None:
-                delta = utcnow() - Bus._info_timestamp
-                if delta.total_seconds() < _REFRESH_INTERVAL:
-                    # The state that we already have is less than
-                    # _REFRESH_INTERVAL seconds old: no need to refresh
-                    return
+        ts = Bus._info_monotonic
+        if ts is not None and monotonic() - ts < _REFRESH_INTERVAL:
+            # The state that we already have is less than
+            # _REFRESH_INTERVAL seconds old: no need to refresh
+            # (or to acquire the lock)
+            return
+        if ts is None:
+            # We have no state at all: wait for it
+            Bus._lock.acquire()
+        elif not Bus._lock.acquire(blocking=False):
+            # Another thread is already refreshing the state: rather
+            # than waiting for it, make do with the state we have
+            return
+        try:
+            # Check again, since another thread may have refreshed
+            # the state while we were waiting for the lock
+            ts = Bus._info_monotonic
+            if ts is not None and monotonic() - ts < _REFRESH_INTERVAL:
+                return
             Bus._load_state()
+        finally:
+            Bus._lock.release()
 
     @property
     def route_id(self) -> str:
@@ -1174,24 +1774,109 @@ class BusSchedule:
     """This class constructs a bus schedule for a particular date, by default today,
     which can then be queried."""
 
-    def __init__(self, for_date: Optional[date] = None):
-        """Create a schedule for today: Route, stop, time"""
-        s: DefaultDict[
-            str, DefaultDict[str, DefaultDict[str, List[HmsTuple]]]
-        ] = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    __slots__ = ("_for_date", "_sched", "_by_route_stop")
+
+    # Shared schedule instances, one per date, as returned by for_day()
+    _sched_cache: Dict[date, "BusSchedule"] = dict()
+    _sched_lock = threading.Lock()
+
+    @classmethod
+    def for_day(
+        cls, for_date: Optional[date] = None, *, now: Optional[datetime] = None
+    ) -> "BusSchedule":
+        """Return a shared schedule for the given date, creating it if
+        required. The date defaults to that of now, or of the current time.
+        Since the schedule for each route is built on first access, routes
+        that have already been queried are not built again."""
         if for_date is None:
-            now = utcnow()
+            if now is None:
+                now = utcnow()
+            for_date = date(now.year, now.month, now.day)
+        sched = cls._sched_cache.get(for_date)
+        if sched is None:
+            with cls._sched_lock:
+                sched = cls._sched_cache.get(for_date)
+                if sched is None:
+                    sched = cls(for_date)
+                    # Drop schedules that are more than two days old,
+                    # to bound the memory used by the cache
+                    cutoff = for_date - timedelta(days=2)
+                    cache = {d: s for d, s in cls._sched_cache.items() if d >= cutoff}
+                    cache[for_date] = sched
+                    cls._sched_cache = cache
+        return sched
+
+    @classmethod
+    def clear(cls) -> None:
+        """Clear the cache of shared schedules"""
+        with cls._sched_lock:
+            cls._sched_cache = dict()
+
+    def __init__(
+        self, for_date: Optional[date] = None, *, now: Optional[datetime] = None
+    ):
+        """Create a schedule for today: Route, stop, time.
+        The schedule for each route is built on first access.
+        If for_date is None, the date is taken from now, or from
+        the current time if now is also None."""
+        if for_date is None:
+            if now is None:
+                now = utcnow()
             for_date = date(now.year, now.month, now.day)
         self._for_date = for_date
-        for route in BusRoute.all_routes().values():
-            for service in route.active_services(on_date=for_date):
-                for trip in service.trips:
-                    for hms, halt in trip.sorted_halts:
-                        if halt.stop is not None:
-                            s[route.route_id][trip.last_stop.name][
-                                halt.stop.name
-                            ].append(hms)
-        self._sched = s
+        # route_id -> (direction, stop_name) -> sorted list of
+        # arrival times, as seconds since midnight
+        self._sched: Dict[str, Dict[Tuple[str, str], List[int]]] = dict()
+        # route_id -> stop_name -> list of (direction, sorted times)
+        self._by_route_stop: Dict[str, Dict[str, List[Tuple[str, List[int]]]]] = dict()
+
+    def _ensure_route(self, route_id: str) -> None:
+        """Make sure that the schedule for the given route has been built"""
+        if route_id not in self._sched:
+            self._build(route_id)
+
+    def _build(self, route_id: str) -> None:
+        """Build the schedule for a single route"""
+        s: Dict[Tuple[str, str], List[int]] = dict()
+        route = BusRoute.lookup(route_id)
+        if route is not None:
+            active_trips = [
+                trip
+                for service in route.active_services(on_date=self._for_date)
+                for trip in service.trips
+            ]
+            for trip in active_trips:
+                direction = trip.last_stop.name
+                for stop_name, secs in zip(trip._halt_stop_names, trip._halt_secs):
+                    if stop_name is not None:
+                        key = (direction, stop_name)
+                        times = s.get(key)
+                        if times is None:
+                            s[key] = [secs]
+                        else:
+                            times.append(secs)
+        by_stop: DefaultDict[str, List[Tuple[str, List[int]]]] = defaultdict(list)
+        for (direction, stop_name), times in s.items():
+            times.sort()
+            by_stop[stop_name].append((direction, times))
+        # Publish the index before the schedule itself, since
+        # _ensure_route() checks for the presence of the latter
+        self._by_route_stop[route_id] = dict(by_stop)
+        self._sched[route_id] = s
+
+    def warm_all(self) -> None:
+        """Build the schedule for all routes up front"""
+        for route_id in BusRoute.all_routes():
+            self._ensure_route(route_id)
+
+    def _route_schedule(self, route_id: str) -> Dict[str, Dict[str, List[int]]]:
+        """Return a nested view of the schedule for a given route:
+        direction -> stop_name -> sorted list of times"""
+        self._ensure_route(route_id)
+        r: DefaultDict[str, Dict[str, List[int]]] = defaultdict(dict)
+        for (direction, stop_name), times in self._sched[route_id].items():
+            r[direction][stop_name] = times
+        return r
 
     @property
     def date(self) -> date:
@@ -1205,24 +1890,21 @@ class BusSchedule:
 
     def print_schedule(self, route_id: str) -> None:
         """Print a schedule for a given route"""
-        print("Áætlun leiðar {0:2}".format(route_id))
-        print("----------------")
-        s = self._sched[route_id]
+        lines = [f"Áætlun leiðar {route_id:2}", "----------------"]
+        s = self._route_schedule(route_id)
         for direction, halts in s.items():
-            print("Átt: {0}".format(direction))
+            lines.append(f"Átt: {direction}")
             for stop_name, times in halts.items():
-                print("   Stöð: {0}".format(stop_name))
-                col = 0
-                for hms in sorted(times):
-                    if col == 8:
-                        print()
-                        col = 0
-                    if col == 0:
-                        print("     ", end="")
-                    print(" {0:02}:{1:02}".format(hms[0], hms[1]), end="")
-                    col += 1
-                print()
-        print("\n\n")
+                lines.append(f"   Stöð: {stop_name}")
+                hhmm = (f" {secs // 3600:02}:{secs // 60 % 60:02}" for secs in times)
+                # Break the times into rows of 8 columns each
+                rows = [
+                    "     " + "".join(row)
+                    for row in iter(lambda: list(islice(hhmm, 8)), [])
+                ]
+                lines.extend(rows or [""])
+        lines.append("\n\n\n")
+        sys.stdout.write("\n".join(lines))
 
     def arrivals(
         self,
@@ -1232,12 +1914,13 @@ class BusSchedule:
         n: int = 2,
         after_hms: Optional[HmsTuple] = None,
         area_priority: Tuple[str, ...] = _DEFAULT_AREA_PRIORITY,
+        now: Optional[datetime] = None,
     ) -> Tuple[Dict[str, List[HmsTuple]], bool]:
         """Return a list of the subsequent arrivals of buses on the
         given route at the indicated stop, with reference to the
-        given timepoint, or the current time if None. Also returns
-        a boolean indicating whether the bus arrives at all at this
-        stop today."""
+        given timepoint, or to now (by default the current time) if None.
+        Also returns a boolean indicating whether the bus arrives at all
+        at this stop today."""
         # h is a list of halts for each direction
         h: DefaultDict[str, List[HmsTuple]] = defaultdict(list)
         route_id = BusRoute.make_id(route_number, area_priority=area_priority)
@@ -1245,26 +1928,29 @@ class BusSchedule:
         if route_id is None:
             return h, arrives
         if after_hms is None:
-            now = utcnow()
-            after_hms = (now.hour, now.minute, now.second)
-        s = self._sched[route_id]
-        for direction, halts in s.items():
-            for halt_stop_name, times in halts.items():
-                if halt_stop_name == stop.name:
-                    # Note that the bus arrives at some point today,
-                    # according to the schedule
-                    arrives = True
-                    # Don't include halts at final stops in the direction
-                    # of that same stop
-                    if halt_stop_name != direction:
-                        # Only include halts that occcur after the requested time
-                        hlist = [hms for hms in times if hms >= after_hms]
-                        if hlist:
-                            h[direction] += hlist
-        for direction, arrival_times in h.items():
-            # Return the first N subsequent arrival times
-            # for each direction
-            h[direction] = sorted(arrival_times)[:n]
+            if now is None:
+                now = utcnow()
+            after_secs = now.hour * 3600 + now.minute * 60 + now.second
+        else:
+            after_secs = _pack_hms(after_hms)
+        stop_name = stop.name
+        self._ensure_route(route_id)
+        directions = self._by_route_stop[route_id].get(stop_name)
+        if not directions:
+            return h, arrives
+        # Note that the bus arrives at some point today,
+        # according to the schedule
+        arrives = True
+        for direction, times in directions:
+            # Don't include halts at final stops in the direction
+            # of that same stop
+            if stop_name != direction:
+                # Only include halts that occcur after the requested time,
+                # and return the first N of them for each direction
+                ix = bisect_left(times, after_secs)
+                hlist = [_unpack_hms(secs) for secs in times[ix : ix + n]]
+                if hlist:
+                    h[direction] = hlist
         return h, arrives
 
     def predicted_arrival(
@@ -1273,9 +1959,11 @@ class BusSchedule:
         stop: BusStop,
         *,
         area_priority: Tuple[str, ...] = _DEFAULT_AREA_PRIORITY,
+        now: Optional[datetime] = None,
     ) -> Optional[Dict[str, List[HmsTuple]]]:
         """Predicts when the next bus will arrive on route route_id
-        at stop stop_name."""
+        at stop stop_name, with reference to now (by default
+        the current time). A naive now is taken to be in UTC."""
 
         # The function attempts to predict the arrival time, at a particular
         # stop, of the next bus on a given route. It does so by inference from
@@ -1298,47 +1986,37 @@ class BusSchedule:
         if route is None:
             return None
 
-        # Establish the current time in h:m:s format
-        now = utcnow()
-        today = date.today()
-        after_hms = (now.hour, now.minute, now.second)
+        # Establish the current time, as seconds since midnight
+        if now is None:
+            now = utcnow()
+        elif now.tzinfo is None:
+            # Bus timestamps are aware, so now must be too
+            now = now.replace(tzinfo=timezone.utc)
+        after_secs = now.hour * 3600 + now.minute * 60 + now.second
         # Find the trip that is closest to the current time
         closest_trip: Dict[str, BusTrip] = dict()
         closest_gap: Dict[str, float] = dict()
 
         def gap(trip: BusTrip) -> int:
-            def diff(hms1: HmsTuple, hms2: HmsTuple) -> int:
-                """Return the number of seconds between the two (h, m, s) tuples"""
-                if hms1[0] >= 24:
-                    # Apparently, some arrival times can exceed 23 hours,
-                    # so we must account for that (since Python doesn't)
-                    t1 = datetime.combine(
-                        today + timedelta(days=1), time(hms1[0] - 24, hms1[1], hms1[2])
-                    )
-                else:
-                    t1 = datetime.combine(today, time(*hms1))
-                if hms2[0] >= 24:
-                    t2 = datetime.combine(
-                        today + timedelta(days=1), time(hms2[0] - 24, hms2[1], hms2[2])
-                    )
-                else:
-                    t2 = datetime.combine(today, time(*hms2))
-                return int((t2 - t1).total_seconds())
-
-            if trip.start_time > after_hms:
+            # Arrival times are in seconds since midnight of the service date,
+            # and can exceed 24 hours; the current time never does
+            start_secs = trip._start_secs
+            end_secs = trip._end_secs
+            assert start_secs is not None and end_secs is not None
+            if start_secs > after_secs:
                 # The trip has not yet started: we won't use it as a basis
                 # for prediction, since it is possible that a bus may start
                 # the trip at the correct time even if it doesn't show up in
                 # the real-time data
                 return -1
-            elif trip.end_time < after_hms:
+            elif end_secs < after_secs:
                 # The trip should be already completed, but we include it
                 # anyway, since we may have late buses still on it
-                return diff(trip.end_time, after_hms)
+                return after_secs - end_secs
             # The trip is underway
             return 0
 
-        for service in route.active_services_today():
+        for service in route.active_services_today(now):
             for trip in service.trips:
                 # Only include trips that stop at the queried stop(s)
                 if trip.stops_at(stop.stop_id):
@@ -1362,17 +2040,28 @@ class BusSchedule:
         trips = list(closest_trip.values())
         buses = Bus.buses_on_route(route_id)
         result: Dict[str, datetime] = dict()
+        # Distances between consecutive stops, shared by buses on the same segment
+        segment_distances: Dict[Tuple[str, str], float] = dict()
         for bus in buses:
             # For each currently active bus, find the trips that are in
             # a direction that matches its last and next stops, and that
             # will subsequently stop at the queried stop.
             bus_stop_tuple = (bus.stop_id, bus.next_stop_id)
+            matching_trips = [
+                trip for trip in trips if trip.has_consecutive_stops(*bus_stop_tuple)
+            ]
+            if not matching_trips:
+                # No need to calculate distances for this bus
+                continue
             bus_stop = BusStop.lookup(bus.stop_id)
             next_stop = BusStop.lookup(bus.next_stop_id)
             # Calculate the distance between the last stop and the next
             # stop of the bus, as the crow flies
             if bus_stop is not None and next_stop is not None:
-                d_stops = distance(bus_stop.location, next_stop.location)
+                d_stops = segment_distances.get(bus_stop_tuple)
+                if d_stops is None:
+                    d_stops = distance(bus_stop.location, next_stop.location)
+                    segment_distances[bus_stop_tuple] = d_stops
             else:
                 d_stops = 0.0
             # Calculate the distance between the bus and the next stop,
@@ -1391,11 +2080,7 @@ class BusSchedule:
             else:
                 # The ratio can never be larger than 1.0
                 d_ratio = min(d_bus / d_stops, 1.0)
-            for trip in trips:
-                # Check whether this trip includes stops that match the
-                # last and next stops of the bus
-                if not trip.has_consecutive_stops(*bus_stop_tuple):
-                    continue
+            for trip in matching_trips:
                 # Check whether the stop we want is a subsequent stop for the bus
                 last_halt, next_halt, our_halt = trip.following_halt(
                     stop.stop_id, bus.stop_id
@@ -1509,9 +2194,130 @@ def print_next_arrivals(
             )
 
 
+# The class attributes that hold the schedule data, as saved in the cache
+_CACHED_ATTRS: Tuple[Tuple[type, Tuple[str, ...]], ...] = (
+    (BusCalendar, ("_calendar",)),
+    (
+        BusTrip,
+        (
+            "_all_trips",
+            "_stop_sets",
+            "_consecutive_stop_sets",
+            "_stop_position_maps",
+        ),
+    ),
+    (BusService, ("_all_services", "_schedules")),
+    (BusRoute, ("_all_routes",)),
+    (
+        BusStop,
+        (
+            "_all_stops",
+            "_all_stops_by_name",
+            "_lats",
+            "_lons",
+            "_cos_lats",
+            "_stop_index",
+            "_grid",
+            "_word_index",
+        ),
+    ),
+)
+
+
+def _cache_key() -> Optional[_CacheKey]:
+    """Return a key that identifies the current versions of the GTFS files,
+    of this module and of Python, or None if the files are not found"""
+    paths: List[str] = []
+    for name in _GTFS_FILES:
+        path = _RESOURCES_PATH(name)
+        # The file may be read directly from the GTFS.zip file
+        paths.append(path if os.path.exists(path) else _GTFS_PATH)
+    # Changes to the classes may change the pickled representation
+    paths.append(__file__)
+    key: List[Tuple[str, int, int]] = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key.append((path, st.st_mtime_ns, st.st_size))
+    return (tuple(sys.version_info[:2]), _CACHE_PROTOCOL, tuple(key))
+
+
+def _load_cache(key: _CacheKey) -> bool:
+    """Load the schedule data from the cache file, if it was
+    written for the given key. Return True if successful."""
+    try:
+        with open(_CACHE_PATH, "rb") as f:
+            if pickle.load(f) != key:
+                return False
+            state = pickle.load(f)
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logging.warning(f"Unable to read cache file '{_CACHE_PATH}': {e}")
+        return False
+    for (cls, names), values in zip(_CACHED_ATTRS, state):
+        for name, value in zip(names, values):
+            setattr(cls, name, value)
+    # Clear all caches that depend on the previous data
+    BusCalendar._today = None
+    BusRoute._sorted_routes = None
+    _active_services_cached.cache_clear()
+    _route_id_cached.cache_clear()
+    _closest_stops_cached.cache_clear()
+    _named_fuzzy_cached.cache_clear()
+    return True
+
+
+def _save_cache(key: _CacheKey) -> None:
+    """Save the schedule data to the cache file, for the given key"""
+    state = [
+        [getattr(cls, name) for name in names] for cls, names in _CACHED_ATTRS
+    ]
+    tmp_path = f"{_CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(key, f, protocol=_CACHE_PROTOCOL)
+            pickle.dump(state, f, protocol=_CACHE_PROTOCOL)
+        # Replace the cache file atomically, in case other processes
+        # are reading it at the same time
+        os.replace(tmp_path, _CACHE_PATH)
+    except OSError as e:
+        # Probably not allowed to write to the resources/ subdirectory:
+        # the data will simply be read from the GTFS files next time
+        logging.info(f"Unable to write cache file '{_CACHE_PATH}': {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _remove_cache() -> None:
+    """Remove the cache file, if it exists"""
+    try:
+        os.remove(_CACHE_PATH)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Unable to remove cache file '{_CACHE_PATH}': {e}")
+
+
 def initialize() -> None:
     """(Re-)initialize all schedule data from text files in the
-    resources/ subdirectory"""
+    resources/ subdirectory, or from a cached copy of the data
+    if the files have not changed since it was saved"""
+    key = _cache_key()
+    if key is None or not _load_cache(key):
+        _read_gtfs()
+        if key is not None:
+            _save_cache(key)
+    # Schedules built from the previous data are no longer valid
+    BusSchedule.clear()
+
+
+def _read_gtfs() -> None:
+    """Read all schedule data from the GTFS text files"""
     # Read stops.txt
     BusStop.initialize()
     # Read calendar_dates.txt
@@ -1538,9 +2344,12 @@ def fetch_gtfs() -> bool:
     # Fetch the bus schedule information from the open URL
     try:
         with requests.get(_SCHEDULE_URL, stream=True) as r:
+            # Let urllib3 undo any gzip/deflate content encoding
+            r.raw.decode_content = True
             with open(_GTFS_PATH, "wb") as f:
-                # This is an efficient method to copy file-like streams
-                shutil.copyfileobj(r.raw, f)
+                # This is an efficient method to copy file-like streams,
+                # here with a large buffer since the archive is big
+                shutil.copyfileobj(r.raw, f, _GTFS_BUFFER_SIZE)
     except OSError as e:
         # Something is wrong; unable to fetch
         logging.warning(
@@ -1557,12 +2366,47 @@ def fetch_gtfs() -> bool:
             )
         )
         return False
-    # Successfully downloaded the ZIP archive: extract all files from it
+    # Successfully downloaded the ZIP archive: extract the files from it
+    # that differ from the ones we already have
     with zipfile.ZipFile(_GTFS_PATH, "r") as z:
-        z.extractall(res_path)
+        extracted = _extract_changed(z, res_path)
+    if extracted:
+        # The cached copy of the previous data is now stale
+        _remove_cache()
     return True
 
 
+def _file_crc32(path: str) -> int:
+    """Return the CRC-32 checksum of the contents of a file"""
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, _GTFS_BUFFER_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _extract_changed(z: zipfile.ZipFile, path: str) -> List[str]:
+    """Extract the files in a ZIP archive into the given directory,
+    skipping files that are already there with identical contents.
+    Returns the names of the files that were extracted."""
+    extracted: List[str] = []
+    for info in z.infolist():
+        if not info.is_dir():
+            target = os.path.join(path, info.filename)
+            try:
+                # Compare the sizes first, since that is cheap
+                if os.path.getsize(target) == info.file_size and (
+                    _file_crc32(target) == info.CRC
+                ):
+                    continue
+            except OSError:
+                # Most likely, the file does not exist yet
+                pass
+            extracted.append(info.filename)
+        z.extract(info, path)
+    return extracted
+
+
 def refresh(
     *, if_older_than: Optional[int] = None, re_initialize: bool = False
 ) -> bool:
@@ -1580,7 +2424,7 @@ def refresh(
             pass
         else:
             now = utcnow()
-            ts_file = datetime.fromtimestamp(tm_time)
+            ts_file = datetime.fromtimestamp(tm_time, timezone.utc)
             if now - ts_file <= timedelta(hours=if_older_than):
                 # File is younger than if_older_than: no need to refresh
                 return False
@@ -1600,6 +2444,7 @@ def refresh(
 # When this module is imported, its data is initialized from the text files
 # in the resources/ subdirectory. Subsequently, you may call refresh() to
 # refresh the text files from the Straeto open data source.
+# The command line interface is in __main__.py; run python -m straeto --help
 
 if __name__ != "__main__":
 
@@ -1607,107 +2452,6 @@ if __name__ != "__main__":
 
 else:
 
-    import argparse
-
-    parser = argparse.ArgumentParser(
-        description="A Python wrapper for the bus schedules of Straeto bs"
-    )
-
-    parser.add_argument("--quiet", action="store_true", help="suppress output")
-
-    subparsers = parser.add_subparsers(help="subcommand")
-
-    parser_refresh = subparsers.add_parser(
-        "refresh", help="refresh schedule data from Straeto bs website"
-    )
-
-    parser_refresh.add_argument(
-        "--if_older_than",
-        nargs="?",
-        type=int,
-        default=0,
-        help="refresh only if existing GTFS.ZIP file is older than N hours",
-    )
-
-    parser_test = subparsers.add_parser("test", help="run test code")
-
-    args = parser.parse_args()
-
-    if hasattr(args, "if_older_than"):
-        # This must be the refresh command
-        if refresh(if_older_than=args.if_older_than):
-            if not args.quiet:
-                print("Refresh completed")
-        else:
-            if not args.quiet:
-                print("Refresh was not necessary or not successful")
-        import sys
-
-        sys.exit(0)
-
-    # This must be the 'test' command
-
-    initialize()
-
-    # This main program contains a mix of test and demo cases.
-    # Normally you use Straeto as a module through import, not as a main program.
-
-    if False:
-        # 'Hvar er næsta stoppistöð?'
-        print_closest_stop(_MIDEIND_LOCATION)
-
-    sched_today = BusSchedule()
-
-    if False:
-        # Examples of queries for next halts of particular routes at particular stops
-        # 'Hvenær kemur strætó númer 14?'
-        print_next_arrivals(sched_today, _MIDEIND_LOCATION, "14")
-        print_next_arrivals(sched_today, "Grunnslóð", "14")
-        print_next_arrivals(sched_today, "Grandagarður", "14")
-        print_next_arrivals(sched_today, "Mýrargata", "14")
-
-    if True:
-        # Print today's schedule for a route
-        sched_today.print_schedule("ST.3")
-
-    if False:
-        # Dump the schedule data for all routes
-        for route in BusRoute.all_routes().values():
-            print("{0}:".format(route))
-            for service in route.active_services_today():
-                print("   service {0}".format(service.service_id))
-                for trip in service.trips:
-                    print("      trip {0}".format(trip.trip_id))
-                    for hms, halt in trip.sorted_halts:
-                        print(
-                            "         halt {0:02}:{1:02}:{2:02} at {3}".format(
-                                hms[0], hms[1], hms[2], halt.stop.name
-                            )
-                        )
-
-    if True:
-        # Dump the real-time locations of all buses
-        # all_buses = Bus.all_buses().items()
-        all_buses = [("ST.14", Bus.buses_on_route("ST.14"))]
-        for route_id, val in sorted(all_buses, key=lambda b: b[0].rjust(2)):
-            route = BusRoute.lookup(route_id)
-            print("{0}:".format(route))
-            if route is None:
-                continue
-            for service in route.active_services_today():
-                print("   service {0}".format(service.service_id))
-            for bus in sorted(val, key=lambda bus: entf(bus.location)):
-                print(
-                    "   {6} loc:{0}, head:{1:>6.2f}, stop:{2}, next:{3}, code:{4}, "
-                    "dist:{5:.2f}".format(
-                        locfmt(bus.location),
-                        bus.heading,
-                        bus.stop,
-                        bus.next_stop,
-                        bus.code,
-                        entf(bus.location),
-                        bus.timestamp,
-                    )
-                )
-
-        print_next_arrivals(sched_today, _MIDEIND_LOCATION, "14")
+    # This module is not a main program: python -m straeto is the only
+    # command line entry point
+    sys.exit("Usage: python -m straeto [<command>] [options]")
@@ -23,6 +23,17 @@
 
 """
 
+import io
+import os
+import random
+import zipfile
+from datetime import datetime, timezone
+
+import pytest
+
+import straeto.straeto as S
+from straeto import Bus, BusCalendar, BusHalt, BusRoute, BusService, BusStop, BusTrip
+
 
 def test_straeto():
     """Test the straeto package"""
@@ -31,3 +42,343 @@ def test_straeto():
     assert straeto.__author__
     assert straeto.__copyright__
     assert straeto.__version__
+
+
+def _restore_class_data(monkeypatch, cls):
+    """Have monkeypatch restore the class-level data of cls after a test"""
+    for name, value in list(vars(cls).items()):
+        if (
+            name.startswith("_")
+            and not name.startswith("__")
+            and not hasattr(value, "__get__")
+        ):
+            monkeypatch.setattr(cls, name, value)
+
+
+def _clear_caches():
+    """Clear the lru caches in the straeto module"""
+    for value in list(vars(S).values()):
+        if hasattr(value, "cache_clear"):
+            value.cache_clear()
+
+
+@pytest.fixture
+def resources(tmp_path, monkeypatch):
+    """Point the resources/ subdirectory to an empty temporary directory"""
+    monkeypatch.setattr(
+        S, "_RESOURCES_PATH", lambda *args: os.path.join(tmp_path, *args)
+    )
+    return tmp_path
+
+
+@pytest.fixture
+def synthetic_stops(resources, monkeypatch):
+    """Replace the loaded bus stops with random stops in and around Reykjavík,
+    plus a few elsewhere, restoring the original stops afterwards"""
+    _restore_class_data(monkeypatch, BusStop)
+    rnd = random.Random(42)
+    locations = [
+        (64.05 + rnd.random() * 0.2, -22.05 + rnd.random() * 0.4) for _ in range(500)
+    ]
+    # Akureyri, Egilsstaðir, Vík, and one stop on the other side of the globe
+    locations += [(65.68, -18.09), (65.26, -14.39), (63.42, -19.01), (-41.3, 174.8)]
+    with open(os.path.join(resources, "stops.txt"), "w", encoding="utf-8") as f:
+        f.write("stop_id,stop_name,stop_lat,stop_lon,location_type\n")
+        for i, (lat, lon) in enumerate(locations):
+            f.write(f"S{i},Stop {i},{lat:.6f},{lon:.6f},0\n")
+    _clear_caches()
+    BusStop.initialize()
+    yield [BusStop._all_stops[f"S{i}"] for i in range(len(locations))]
+    _clear_caches()
+
+
+def test_named_fuzzy(synthetic_stops):
+    """Fuzzy name matching must match whole words only"""
+    ids = {stop.stop_id for stop in BusStop.named("stop 12", fuzzy=True)}
+    assert ids == {"S12"}
+    ids = {stop.stop_id for stop in BusStop.named("Stop", fuzzy=True)}
+    assert len(ids) == len(synthetic_stops)
+    assert BusStop.named("top 1", fuzzy=True) == []
+    assert [stop.stop_id for stop in BusStop.named("Stop 3")] == ["S3"]
+
+
+def test_named_fuzzy_punctuation(resources, monkeypatch):
+    """Fuzzy name matching must work for strings that begin or end
+    with punctuation"""
+    _restore_class_data(monkeypatch, BusStop)
+    with open(os.path.join(resources, "stops.txt"), "w", encoding="utf-8") as f:
+        f.write("stop_id,stop_name,stop_lat,stop_lon,location_type\n")
+        f.write("S1,Umferðarmiðstöðin (BSÍ),64.137,-21.935,0\n")
+        f.write("S2,BSÍ,64.138,-21.934,0\n")
+        f.write("S3,Hlemmur,64.143,-21.915,0\n")
+    _clear_caches()
+    BusStop.initialize()
+    try:
+        for name in ("(bsí)", "(BSÍ)", "umferðarmiðstöðin (bsí)"):
+            ids = {stop.stop_id for stop in BusStop.named(name, fuzzy=True)}
+            assert ids == {"S1"}, name
+        assert BusStop.named("n (bsí)", fuzzy=True) == []
+        ids = {stop.stop_id for stop in BusStop.named("bsí", fuzzy=True)}
+        assert ids == {"S1", "S2"}
+        assert BusStop.named("sí)", fuzzy=True) == []
+    finally:
+        _clear_caches()
+
+
+def test_closest_to_list(synthetic_stops):
+    """The grid search must find the same stops as a scan of all stops,
+    for the query location rounded to _LOCATION_CACHE_DECIMALS"""
+    decimals = S._LOCATION_CACHE_DECIMALS
+    rnd = random.Random(7)
+    queries = [
+        (64.0 + rnd.random() * 0.3, -22.1 + rnd.random() * 0.5) for _ in range(100)
+    ]
+    # Queries far outside the grid cells that contain stops
+    queries += [(0.0, 0.0), (65.0, -18.0), (-45.0, 170.0), (89.9, 10.0), (-89.9, 0.0)]
+    for location in queries:
+        rounded = (round(location[0], decimals), round(location[1], decimals))
+        by_distance = sorted(
+            synthetic_stops, key=lambda stop: S.distance(rounded, stop.location)
+        )
+        for n in (1, 5, 25):
+            expected = [stop.stop_id for stop in by_distance[:n]]
+            found = [stop.stop_id for stop in BusStop.closest_to_list(location, n=n)]
+            assert found == expected, (location, n)
+        # Rounding moves the query by about a meter at most, so the closest
+        # stop found is at most a couple of meters farther away than the
+        # truly closest one
+        closest = BusStop.closest_to_list(location)[0]
+        shortest = min(S.distance(location, stop.location) for stop in synthetic_stops)
+        assert S.distance(location, closest.location) - shortest < 0.002, location
+        # Nearby queries that round to the same location share a cache entry
+        nearby = (rounded[0] + 10 ** -(decimals + 2), rounded[1])
+        result = BusStop.closest_to_list(rounded, n=5)
+        hits = S._closest_stops_cached.cache_info().hits
+        assert BusStop.closest_to_list(nearby, n=5) == result
+        assert S._closest_stops_cached.cache_info().hits == hits + 1
+        for radius in (0.5, 2.0, 50.0, 500.0):
+            expected_set = {
+                stop.stop_id
+                for stop in synthetic_stops
+                if S.distance(rounded, stop.location) <= radius
+            }
+            found_list = BusStop.closest_to_list(location, n=1000, within_radius=radius)
+            assert {stop.stop_id for stop in found_list} == expected_set, (
+                location,
+                radius,
+            )
+    # Asking for more stops than there are returns all of them
+    assert len(BusStop.closest_to_list((64.1, -21.9), n=10000)) == len(synthetic_stops)
+    assert BusStop.closest_to_list((64.1, -21.9), n=0) == []
+
+
+_STATUS_XML = b"""<?xml version="1.0" encoding="utf-8"?>
+<buses>
+  <bus time="231015083015" lat="64.145" lon="-21.93" head="90.5"
+    route="14" stop="90000001" next="90000002" code="2"/>
+  <bus time="231015083120" lat="64.120" lon="-21.80" head="180"
+    route="14" stop="90000003" next="90000004" code="1"/>
+  <bus time="231015083200" lat="63.9" lon="-22.5" route="A1" stop="1" next="2"/>
+  <bus time="231015083300" lat="64.0" lon="-21.0" route="R2" stop="3" next="4"/>
+  <bus time="2310" lat="64.0" lon="-21.0" route="3" stop="5" next="6"/>
+  <bus time="231015083300" lat="64.0" lon="-21.0" route="3" stop="" next="6"/>
+  <bus time="231015083300" lat="64.0" lon="-21.0" stop="5" next="6"/>
+</buses>
+"""
+
+
+@pytest.fixture
+def bus_state(monkeypatch):
+    """Restore the real-time bus state afterwards"""
+    _restore_class_data(monkeypatch, Bus)
+
+
+def test_load_state_from_file(resources, bus_state, monkeypatch):
+    """Bus state is read from the status file if there is no status URL"""
+    monkeypatch.setattr(S, "_STATUS_URL", "")
+    status_file = os.path.join(resources, "status.xml")
+    monkeypatch.setattr(S, "_STATUS_FILE", status_file)
+    with open(status_file, "wb") as f:
+        f.write(_STATUS_XML)
+    Bus._load_state()
+    buses = Bus._all_buses
+    assert sorted(buses.keys()) == ["AF.1", "RY.2", "ST.14"]
+    b1, b2 = buses["ST.14"]
+    assert b1.route_id == "ST.14"
+    assert b1.location == (64.145, -21.93)
+    assert b1.heading == 90.5
+    assert (b1.stop_id, b1.next_stop_id, b1.code) == ("90000001", "90000002", 2)
+    assert b1.timestamp == datetime(2023, 10, 15, 8, 30, 15, tzinfo=timezone.utc)
+    assert b2.timestamp == datetime(2023, 10, 15, 8, 31, 20, tzinfo=timezone.utc)
+    assert buses["AF.1"][0].heading == 0.0
+    assert buses["AF.1"][0].code == 0
+    assert Bus._info_timestamp is not None
+    # A truncated or malformed status file keeps the previous state
+    for body in (_STATUS_XML[:-40], _STATUS_XML.replace(b"<bus ", b"<bus <", 1)):
+        with open(status_file, "wb") as f:
+            f.write(body)
+        Bus._load_state()
+        assert Bus._all_buses is buses
+    # Without a status file, the state is cleared
+    os.remove(status_file)
+    Bus._load_state()
+    assert not Bus._all_buses
+
+
+class _Response:
+
+    """A minimal stand-in for a streamed requests.Response"""
+
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.raw = _Raw(body)
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _Raw(io.BytesIO):
+
+    decode_content = False
+
+
+class _Session:
+
+    """Return the given responses in turn, noting the request headers"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(dict(headers or {}))
+        return self.responses.pop(0)
+
+
+def test_fetch_state_not_modified(bus_state, monkeypatch):
+    """A 304 response keeps the buses that were previously fetched"""
+    last_modified = "Sun, 15 Oct 2023 08:35:00 GMT"
+    session = _Session(
+        _Response(200, _STATUS_XML, {"Last-Modified": last_modified, "ETag": '"x1"'}),
+        _Response(304),
+        _Response(500),
+        _Response(200, _STATUS_XML, {"ETag": '"x2"'}),
+        _Response(200, _STATUS_XML[:-40], {"ETag": '"x3"'}),
+        _Response(200, b"<buses/>"),
+    )
+    monkeypatch.setattr(S, "_session", session)
+    monkeypatch.setattr(S, "_STATUS_URL", "http://127.0.0.1/status.xml")
+    monkeypatch.setattr(Bus, "_last_modified", None)
+    monkeypatch.setattr(Bus, "_etag", None)
+    Bus._load_state()
+    assert session.requests[0] == {}
+    buses = Bus._all_buses
+    assert len(buses["ST.14"]) == 2
+    assert (Bus._last_modified, Bus._etag) == (last_modified, '"x1"')
+    # Not modified: the state is kept, with a new refresh time
+    refreshed = Bus._info_monotonic
+    Bus._load_state()
+    assert session.requests[1] == {
+        "If-Modified-Since": last_modified,
+        "If-None-Match": '"x1"',
+    }
+    assert Bus._all_buses is buses
+    assert Bus._info_monotonic is not None and Bus._info_monotonic >= refreshed
+    # An error drops the validators, so that the next request is unconditional
+    monkeypatch.setattr(S, "_STATUS_FILE", os.path.join(os.sep, "no", "such", "file"))
+    Bus._load_state()
+    assert (Bus._last_modified, Bus._etag) == (None, None)
+    assert not Bus._all_buses
+    Bus._load_state()
+    assert session.requests[3] == {}
+    buses = Bus._all_buses
+    assert Bus._etag == '"x2"'
+    # A truncated response keeps the previous state, and also drops
+    # the validators, since they do not describe that state
+    Bus._load_state()
+    assert session.requests[4] == {"If-None-Match": '"x2"'}
+    assert Bus._all_buses is buses
+    assert (Bus._last_modified, Bus._etag) == (None, None)
+    Bus._load_state()
+    assert session.requests[5] == {}
+
+
+@pytest.fixture
+def schedule_state(resources, monkeypatch):
+    """Use a temporary cache file, and restore the schedule data afterwards"""
+    monkeypatch.setattr(S, "_CACHE_PATH", os.path.join(resources, "gtfs.pkl"))
+    for cls in (BusCalendar, BusTrip, BusService, BusRoute, BusStop, BusHalt):
+        _restore_class_data(monkeypatch, cls)
+    yield
+    _clear_caches()
+
+
+def test_cache_round_trip(schedule_state):
+    """Schedule data saved in the cache is loaded back, but only
+    if the cache key matches"""
+    routes = sorted(BusRoute._all_routes)
+    key = ((3, 7), 4, (("stops.txt", 1, 2),))
+    other_key = ((3, 7), 4, (("stops.txt", 1, 3),))
+    assert not S._load_cache(key)
+    S._save_cache(key)
+    BusRoute._all_routes = dict()
+    assert not S._load_cache(other_key)
+    assert BusRoute._all_routes == {}
+    assert S._load_cache(key)
+    assert sorted(BusRoute._all_routes) == routes
+
+
+def test_cache_invalidation(schedule_state, monkeypatch):
+    """initialize() reads the GTFS files unless the cache key matches"""
+    parsed = []
+    for cls in (BusStop, BusCalendar, BusRoute, BusHalt, BusTrip, BusService):
+        record = staticmethod(lambda name=cls.__name__: parsed.append(name))
+        monkeypatch.setattr(cls, "initialize", record)
+    key = ((3, 7), 4, (("stops.txt", 1, 2),))
+    monkeypatch.setattr(S, "_cache_key", lambda: key)
+    # No cache file yet: parse, and save the cache
+    S.initialize()
+    assert "BusHalt" in parsed
+    assert os.path.exists(S._CACHE_PATH)
+    # Same key: load from the cache
+    parsed.clear()
+    S.initialize()
+    assert not parsed
+    # Changed key, e.g. a changed file: parse again
+    key = ((3, 7), 4, (("stops.txt", 2, 2),))
+    S.initialize()
+    assert "BusHalt" in parsed
+
+
+def test_extract_changed(tmp_path):
+    """Only new or changed files are extracted from a GTFS archive"""
+    zip_path = os.path.join(tmp_path, "gtfs.zip")
+    target = os.path.join(tmp_path, "out")
+    os.mkdir(target)
+    contents = {"stops.txt": "a,b\n1,2\n", "trips.txt": "c,d\n3,4\n"}
+    with zipfile.ZipFile(zip_path, "w") as z:
+        for name, text in contents.items():
+            z.writestr(name, text)
+    with zipfile.ZipFile(zip_path) as z:
+        assert sorted(S._extract_changed(z, target)) == ["stops.txt", "trips.txt"]
+        for name, text in contents.items():
+            with open(os.path.join(target, name), encoding="utf-8") as f:
+                assert f.read() == text
+        # Nothing has changed
+        assert S._extract_changed(z, target) == []
+        # Same size, different contents
+        with open(os.path.join(target, "trips.txt"), "w", encoding="utf-8") as f:
+            f.write("c,d\n3,5\n")
+        assert S._extract_changed(z, target) == ["trips.txt"]
+        # Different size
+        os.remove(os.path.join(target, "stops.txt"))
+        assert S._extract_changed(z, target) == ["stops.txt"]
+        with open(os.path.join(target, "trips.txt"), encoding="utf-8") as f:
+            assert f.read() == contents["trips.txt"]